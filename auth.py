@@ -8,15 +8,15 @@ Gestisce:
 - Validazione input per prevenire SQL injection
 """
 
-import json
-import re
+import functools
+import os
+import time
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import pandas as pd
-from pathlib import Path
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Tuple, Iterator
 from dataclasses import dataclass
-from datetime import datetime
 from streamlit_gsheets import GSheetsConnection
 
 
@@ -26,6 +26,147 @@ class User:
     username: str
     display_name: str
 
+
+@dataclass(slots=True)
+class UserRec:
+    """Record di un utente registrato, come letto dal foglio utenti"""
+    password_hash: bytes
+    display_name: str
+
+
+# Costo bcrypt (2^rounds iterazioni): 10 è ~4 volte più veloce del default 12
+# e resta adeguato per un'app di quiz; configurabile con la variabile BCRYPT_COST.
+# La verifica legge il costo dall'hash salvato, quindi gli hash esistenti restano validi.
+# Il valore viene limitato all'intervallo ammesso da bcrypt (4-31).
+_BCRYPT_COST = min(max(int(os.environ.get("BCRYPT_COST", "10")), 4), 31)
+
+# Prefissi validi di un hash bcrypt (lungo sempre 60 caratteri)
+_BCRYPT_PREFIXES = (b'$2a$', b'$2b$', b'$2y$')
+
+# Costo degli hash salvati prima di BCRYPT_COST (default di bcrypt.gensalt())
+_LEGACY_BCRYPT_COST = 12
+
+# Con CONSTANT_TIME_AUTH attivo, il login di un utente inesistente esegue comunque
+# un confronto bcrypt contro un hash fittizio, costruito al costo più alto tra gli hash
+# salvati (almeno quello degli hash legacy): non è mai più veloce del login di un utente
+# esistente. I tempi coincidono per tutti solo se gli hash salvati hanno lo stesso costo
+_CONSTANT_TIME_AUTH = os.environ.get("CONSTANT_TIME_AUTH", "").lower() in ("1", "true", "yes")
+_MIN_DUMMY_COST = max(_BCRYPT_COST, _LEGACY_BCRYPT_COST)
+
+
+@functools.lru_cache(maxsize=None)
+def _dummy_hash(cost: int) -> bytes:
+    """
+    Hash fittizio per i confronti a tempo costante, calcolato una volta per costo
+    
+    Args:
+        cost: costo bcrypt dell'hash
+        
+    Returns:
+        Hash bcrypt di una password fittizia
+    """
+    return bcrypt.hashpw(b"x", bcrypt.gensalt(rounds=cost))
+
+
+# Precalcolato all'avvio: il primo login di un utente inesistente non paga anche la generazione
+if _CONSTANT_TIME_AUTH:
+    _dummy_hash(_MIN_DUMMY_COST)
+
+# Pool dedicato a bcrypt: hashpw/checkpw rilasciano il GIL, quindi girano in
+# parallelo agli altri script Streamlit; il numero di worker limita quanti
+# hash costosi possono occupare la CPU nello stesso momento.
+_BCRYPT_POOL = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="bcrypt")
+
+# Esiti di errore di _validate_password, indicizzati per bit di errore
+# (1 = vuota, 2 = troppo corta, 4 = troppo lunga)
+_PASSWORD_ERRORS = {
+    1: (False, "Password non può essere vuota"),
+    2: (False, "Password deve essere almeno 6 caratteri"),
+    4: (False, "Password troppo lunga (max 30 caratteri)"),
+}
+
+# Intestazione del foglio utenti, scritta alla prima registrazione se il foglio è vuoto
+_USER_HEADERS = ["username", "password_hash", "display_name", "registration_date"]
+
+# Durata (secondi) della cache delle letture utenti da Google Sheets
+_USERS_CACHE_TTL = 30
+
+
+@st.cache_data(ttl=_USERS_CACHE_TTL, show_spinner=False)
+def _load_users_cached(_conn, worksheet_name: str) -> Dict[str, UserRec]:
+    """
+    Legge tutti gli utenti dal foglio, con cache TTL condivisa tra le sessioni
+    
+    Args:
+        _conn: connessione a Google Sheets (esclusa dalla chiave di cache)
+        worksheet_name: nome del foglio utenti
+        
+    Returns:
+        Dizionario {username: UserRec}
+    """
+    df = _conn.read(worksheet=worksheet_name, ttl=0)
+    
+    if df.empty or 'username' not in df.columns:
+        return {}
+    
+    # Estrazione per colonne (niente iterrows, che crea una Series per riga)
+    empty = pd.Series('', index=df.index)
+    usernames = df['username'].fillna('').astype(str)
+    hashes = df.get('password_hash', empty).fillna('').astype(str)
+    display_names = df.get('display_name', empty).fillna('').astype(str)
+    # Fallback vettoriale: display_name vuoto -> username
+    display_names = display_names.where(display_names != '', usernames)
+    
+    return {
+        username: UserRec(password_hash.encode('utf-8'), display_name)
+        for username, password_hash, display_name in zip(usernames.tolist(), hashes.tolist(), display_names.tolist())
+        if username
+    }
+
+
+@st.cache_data(ttl=_USERS_CACHE_TTL, show_spinner=False)
+def _load_username_index(_conn, worksheet_name: str) -> Dict[str, str]:
+    """
+    Indice case-insensitive degli username, ricostruito solo quando la cache scade
+    
+    Args:
+        _conn: connessione a Google Sheets (esclusa dalla chiave di cache)
+        worksheet_name: nome del foglio utenti
+        
+    Returns:
+        Dizionario {username in minuscolo: username come registrato}
+    """
+    return {username.lower(): username for username in _load_users_cached(_conn, worksheet_name)}
+
+
+@st.cache_data(ttl=_USERS_CACHE_TTL, show_spinner=False)
+def _load_max_hash_cost(_conn, worksheet_name: str) -> int:
+    """
+    Costo bcrypt più alto tra gli hash salvati, per l'hash fittizio di CONSTANT_TIME_AUTH
+    
+    Args:
+        _conn: connessione a Google Sheets (esclusa dalla chiave di cache)
+        worksheet_name: nome del foglio utenti
+        
+    Returns:
+        Costo massimo, mai inferiore a quello di default e degli hash legacy
+    """
+    # Formato bcrypt: $2b$<costo a due cifre>$...
+    costs = (
+        int(user.password_hash[4:6])
+        for user in _load_users_cached(_conn, worksheet_name).values()
+        if user.password_hash.startswith(_BCRYPT_PREFIXES) and user.password_hash[4:6].isdigit()
+    )
+    return min(max(_MIN_DUMMY_COST, max(costs, default=0)), 31)
+
+
+def _clear_users_cache():
+    """Invalida la cache degli utenti (da chiamare dopo ogni scrittura sul foglio)"""
+    _load_users_cached.clear()
+    _load_username_index.clear()
+    _load_max_hash_cost.clear()
+
+
 class AuthManager:
     """
     Gestisce l'autenticazione degli utenti.
@@ -35,6 +176,7 @@ class AuthManager:
     def __init__(self):
         """Inizializza il gestore autenticazione"""
         self.worksheet_name = "users"
+        self._conn = None
     
     @staticmethod
     def _validate_username(username: str) -> Tuple[bool, str]:
@@ -47,17 +189,18 @@ class AuthManager:
         Returns:
             Tupla (valid, error_message)
         """
-        if not username:
-            return False, "Username non può essere vuoto"
-        
-        if len(username) < 3:
-            return False, "Username deve essere almeno 3 caratteri"
-        
-        if len(username) > 50:
+        # Un solo confronto sul percorso valido; il messaggio si sceglie solo in caso di errore
+        n = len(username) if username else 0
+        if not 3 <= n <= 50:
+            if n == 0:
+                return False, "Username non può essere vuoto"
+            if n < 3:
+                return False, "Username deve essere almeno 3 caratteri"
             return False, "Username troppo lungo (max 50 caratteri)"
         
-        # Solo lettere, numeri, underscore, trattino
-        if not re.match(r'^[a-zA-Z0-9_-]+$', username):
+        # Solo lettere, numeri, underscore, trattino (isascii esclude lettere accentate per isalnum)
+        alnum_part = username.replace('_', '').replace('-', '')
+        if not (username.isascii() and (not alnum_part or alnum_part.isalnum())):
             return False, "Username può contenere solo lettere, numeri, underscore e trattino"
         
         return True, ""
@@ -73,19 +216,17 @@ class AuthManager:
         Returns:
             Tupla (valid, error_message)
         """
-        if not password:
-            return False, "Password non può essere vuota"
-        
-        if len(password) < 6:
-            return False, "Password deve essere almeno 6 caratteri"
-        
-        if len(password) > 30:
-            return False, "Password troppo lunga (max 30 caratteri)"
+        # Le condizioni di errore diventano bit di un unico intero: il percorso valido
+        # fa un solo controllo, il bit meno significativo sceglie il messaggio
+        n = len(password) if password else 0
+        flags = (n == 0) | ((n < 6) << 1) | ((n > 30) << 2)
+        if flags:
+            return _PASSWORD_ERRORS[flags & -flags]
         
         return True, ""
     
     @staticmethod
-    def _hash_password(password: str) -> str:
+    def _hash_password(password: str) -> bytes:
         """
         Hash della password usando bcrypt
         
@@ -93,90 +234,117 @@ class AuthManager:
             password: password in chiaro
             
         Returns:
-            Password hashata come stringa
+            Password hashata (bytes, decodificata solo quando viene scritta sul foglio)
         """
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-        return hashed.decode('utf-8')
+        salt = bcrypt.gensalt(rounds=_BCRYPT_COST)
+        return bcrypt.hashpw(password.encode('utf-8'), salt)
     
     @staticmethod
-    def _verify_password(password: str, hashed: str) -> bool:
+    def _verify_password(password: str, hashed: bytes, dummy: Optional[bytes] = None) -> bool:
         """
         Verifica password contro hash
         
         Args:
             password: password in chiaro
-            hashed: password hashata
+            hashed: password hashata (bytes, come salvata nella cache utenti)
+            dummy: hash fittizio (CONSTANT_TIME_AUTH) confrontato al posto di un hash malformato
             
         Returns:
             True se corrispondono
         """
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        # Hash vuoto o malformato: si rifiuta invece di far sollevare ValueError a bcrypt,
+        # dopo lo stesso confronto di un utente inesistente se i tempi non devono rivelarlo
+        if len(hashed) != 60 or not hashed.startswith(_BCRYPT_PREFIXES):
+            if dummy is not None:
+                bcrypt.checkpw(password.encode('utf-8'), dummy)
+            return False
+        return bcrypt.checkpw(password.encode('utf-8'), hashed)
     
     def _get_connection(self):
         """
-        Ottiene la connessione a Google Sheets
+        Ottiene la connessione a Google Sheets (creata alla prima richiesta e riutilizzata)
         
         Returns:
             Connessione a Google Sheets
         """
-        return st.connection("gsheets", type=GSheetsConnection)
+        if self._conn is None:
+            self._conn = st.connection("gsheets", type=GSheetsConnection)
+        return self._conn
     
-    def _get_users_from_sheet(self) -> Dict[str, Dict[str, Any]]:
+    def _get_dummy_hash(self) -> bytes:
         """
-        Carica utenti da Google Sheets
+        Hash fittizio al costo più alto tra quelli salvati (vedi CONSTANT_TIME_AUTH)
         
         Returns:
-            Dizionario {username: {password_hash, display_name}}
+            Hash bcrypt fittizio
         """
         try:
-            conn = self._get_connection()
-            df = conn.read(worksheet=self.worksheet_name, ttl=0)
-            
-            if df.empty:
-                return {}
-            
-            users = {}
-            for _, row in df.iterrows():
-                username = row.get('username', '')
-                if username:
-                    users[username] = {
-                        'password_hash': row.get('password_hash', ''),
-                        'display_name': row.get('display_name', username)
-                    }
-            return users
+            cost = _load_max_hash_cost(self._get_connection(), self.worksheet_name)
+        except Exception:
+            cost = _MIN_DUMMY_COST
+        return _dummy_hash(cost)
+    
+    def _get_users_from_sheet(self) -> Dict[str, UserRec]:
+        """
+        Carica utenti da Google Sheets (con cache TTL)
+        
+        Returns:
+            Dizionario {username: UserRec}
+        """
+        try:
+            return _load_users_cached(self._get_connection(), self.worksheet_name)
         except Exception as e:
             st.error(f"Errore caricamento utenti da Google Sheets: {str(e)}")
             return {}
     
-    def get_user(self, username: str) -> Dict[str, Dict[str, Any]] | None:
-        """Ottiene un singolo utente dal foglio Google Sheets usando query SQL"""
-        # Valida username per prevenire SQL injection
+    def get_user(self, username: str) -> Dict[str, UserRec] | None:
+        """Ottiene un singolo utente dalla mappa utenti in cache (una lettura del foglio per finestra TTL)"""
+        # Valida username prima della ricerca
         valid, error = self._validate_username(username)
         if not valid:
             st.error(f"Username non valido: {error}")
             return None
         
-        try:
-            conn = self._get_connection()
-            query = f"""SELECT username, password_hash, display_name FROM {self.worksheet_name} WHERE username='{username}'"""
-            df = conn.query(sql=query, worksheet=self.worksheet_name, ttl=0)
+        user_info = self._get_users_from_sheet().get(username)
+        if user_info is None:
+            return None
+        return {username: user_info}
+    
+    def _is_username_taken(self, username: str) -> bool:
+        """
+        Verifica se lo username è già registrato (confronto case-insensitive)
+        
+        Args:
+            username: username da verificare
             
-            if df.empty:
-                return None
+        Returns:
+            True se esiste già un utente con lo stesso username
+        """
+        index = _load_username_index(self._get_connection(), self.worksheet_name)
+        return username.lower() in index
+    
+    def _resolve_username(self, username: str) -> Optional[str]:
+        """
+        Trova lo username come registrato, ignorando maiuscole/minuscole
+        (stessa regola usata in registrazione)
+        
+        Args:
+            username: username inserito al login
             
-            row = df.iloc[0]
-            return {
-                username: {
-                    'password_hash': row.get('password_hash', ''),
-                    'display_name': row.get('display_name', username)
-                }
-            }
+        Returns:
+            Username canonico o None se non registrato
+        """
+        # La corrispondenza esatta ha la precedenza (utenti registrati prima della regola case-insensitive)
+        if username in self._get_users_from_sheet():
+            return username
+        try:
+            index = _load_username_index(self._get_connection(), self.worksheet_name)
         except Exception as e:
-            st.error(f"Errore caricamento utente da Google Sheets: {str(e)}")
+            st.error(f"Errore caricamento utenti da Google Sheets: {str(e)}")
             return None
+        return index.get(username.lower())
     
-    def _save_user_to_sheet(self, username: str, password_hash: str, display_name: str) -> bool:
+    def _save_user_to_sheet(self, username: str, password_hash: bytes, display_name: str) -> bool:
         """
         Salva un nuovo utente in Google Sheets
         
@@ -190,24 +358,30 @@ class AuthManager:
         """
         try:
             conn = self._get_connection()
-            registration_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Crea un dataframe con il nuovo utente e usa update in modalità append
-            new_row = pd.DataFrame([{
-                'username': username,
-                'password_hash': password_hash,
-                'display_name': display_name,
-                'registration_date': registration_date
-            }])
+            # Data in UTC, stesso formato di prima, senza costruire un oggetto datetime
+            registration_date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
             
-            # Leggi i dati esistenti e appendi
-            existing_df = conn.read(worksheet=self.worksheet_name, ttl=0)
-            if existing_df.empty:
-                updated_df = new_row
-            else:
-                updated_df = pd.concat([existing_df, new_row], ignore_index=True)
+            values = {
+                "username": username,
+                "password_hash": password_hash.decode('utf-8'),
+                "display_name": display_name,
+                "registration_date": registration_date,
+            }
             
-            conn.update(worksheet=self.worksheet_name, data=updated_df)
+            # Append di una sola riga (spreadsheets.values.append): payload costante,
+            # senza rileggere e riscrivere tutto il foglio
+            worksheet = conn.client._select_worksheet(worksheet=self.worksheet_name)
+            headers = worksheet.row_values(1)
+            if not headers:
+                # Foglio vuoto: l'intestazione deve precedere il primo utente
+                headers = _USER_HEADERS
+                worksheet.append_row(headers, value_input_option='RAW')
+            # Valori nell'ordine delle colonne del foglio, qualunque esso sia
+            worksheet.append_row(
+                [values.get(header, "") for header in headers],
+                value_input_option='RAW'
+            )
+            _clear_users_cache()
             return True
         except Exception as e:
             st.error(f"Errore salvataggio utente: {str(e)}")
@@ -235,13 +409,15 @@ class AuthManager:
         if not valid:
             return False, error
         
-        # Verifica se utente già esistente usando query
-        existing_user = self.get_user(username)
-        if existing_user is not None:
-            return False, "Username già esistente"
+        # Verifica se utente già esistente (case-insensitive, dalla cache utenti)
+        try:
+            if self._is_username_taken(username):
+                return False, "Username già esistente"
+        except Exception as e:
+            return False, f"Errore durante la verifica dello username: {str(e)}"
         
         # Hash password
-        password_hash = self._hash_password(password)
+        password_hash = _BCRYPT_POOL.submit(self._hash_password, password).result()
         
         # Usa username come display_name se non fornito
         if not display_name:
@@ -267,51 +443,52 @@ class AuthManager:
         Returns:
             Oggetto User se autenticazione riuscita, None altrimenti
         """
-        user_data = self.get_user(username=username)
+        canonical = self._resolve_username(username) if username else None
+        user_data = self.get_user(username=canonical) if canonical is not None else None
+        
+        dummy = self._get_dummy_hash() if _CONSTANT_TIME_AUTH else None
         
-        if user_data is None or username not in user_data:
+        if user_data is None or canonical not in user_data:
+            if dummy is not None:
+                _BCRYPT_POOL.submit(self._verify_password, password, dummy).result()
             return None
         
-        user_info = user_data[username]
+        user_info = user_data[canonical]
         
         # Verifica password hashata
-        if not self._verify_password(password, user_info['password_hash']):
+        if not _BCRYPT_POOL.submit(self._verify_password, password, user_info.password_hash, dummy).result():
             return None
         
         return User(
-            username=username,
-            display_name=user_info.get('display_name', username)
+            username=canonical,
+            display_name=user_info.display_name
         )
     
+    def iter_users(self) -> Iterator[Tuple[str, str]]:
+        """
+        Scorre gli utenti (senza password) dalla mappa utenti in cache, senza costruire dizionari intermedi
+        
+        Returns:
+            Iteratore di tuple (username, display_name)
+        """
+        for username, user_info in self._get_users_from_sheet().items():
+            yield username, user_info.display_name
+    
     def get_all_users(self) -> Dict[str, Dict[str, Any]]:
         """
-        Restituisce tutti gli utenti (senza password) usando query SQL
+        Restituisce tutti gli utenti (senza password)
         
         Returns:
             Dizionario con info utenti (esclusa password)
         """
-        try:
-            conn = self._get_connection()
-            query = f"""SELECT username, display_name FROM {self.worksheet_name}"""
-            df = conn.query(sql=query, worksheet=self.worksheet_name, ttl=0)
-            
-            users_safe = {}
-            for _, row in df.iterrows():
-                username = row.get('username', '')
-                if username:
-                    users_safe[username] = {
-                        "display_name": row.get("display_name", username)
-                    }
-            return users_safe
-        except Exception as e:
-            st.error(f"Errore caricamento utenti: {str(e)}")
-            return {}
+        return {username: {"display_name": display_name} for username, display_name in self.iter_users()}
 
 
+@st.cache_resource
 def get_auth_manager() -> AuthManager:
     """
-    Factory function per ottenere un'istanza di AuthManager
-    Utile per dependency injection
+    Factory function per ottenere l'istanza di AuthManager
+    Utile per dependency injection; l'istanza è unica per processo (st.cache_resource)
     """
     return AuthManager()
 
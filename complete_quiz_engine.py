@@ -6,9 +6,13 @@ Gestisce:
 - Valutazione finale
 """
 
-from typing import List, Dict, Any, Optional
+import hmac
+import sys
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 
+from quiz_engine import normalize_answer
+
 
 @dataclass
 class CompleteQuizResult:
@@ -36,19 +40,38 @@ class CompleteQuizEngine:
         if not questions:
             raise ValueError("Cannot initialize quiz with empty questions list")
         
-        self.questions = questions.copy()
+        # Le domande non vengono mai modificate: una tupla basta e ne impedisce la modifica
+        self.questions: Tuple[Dict[str, Any], ...] = tuple(questions)
         self.total_questions = len(questions)
         
+        # Dati statici per la valutazione, precalcolati una volta in liste parallele
+        self._codes = [q["cod_domanda"] for q in questions]
+        self._domande = [q["domanda"] for q in questions]
+        self._correct_answers = [sys.intern(q["risposta_corretta"]) for q in questions]
+        # Risposte corrette normalizzate in bytes UTF-8 per il confronto a tempo costante.
+        # Le risposte ripetute (es. "Vero"/"Falso") condividono un solo oggetto
+        encoded: Dict[str, bytes] = {}
+        self._correct_norm = [
+            encoded.setdefault(norm, norm.encode('utf-8'))
+            for norm in (sys.intern(normalize_answer(answer)) for answer in self._correct_answers)
+        ]
+        
         # Dizionario per salvare le risposte dell'utente
         # Key: indice domanda, Value: risposta selezionata
         self.user_answers: Dict[int, str] = {}
+        # Stesse risposte già normalizzate (bytes UTF-8), calcolate una volta al salvataggio
+        self._normalized_answers: Dict[str, bytes] = {}
+        # Contatore delle domande con risposta non vuota, aggiornato in save_answer
+        self._answered_count = 0
+        # Risultato senza risposte, calcolato alla prima richiesta e poi riutilizzato
+        self._empty_result: Optional[CompleteQuizResult] = None
         
-    def get_all_questions(self) -> List[Dict[str, Any]]:
+    def get_all_questions(self) -> Tuple[Dict[str, Any], ...]:
         """
         Restituisce tutte le domande
         
         Returns:
-            Lista di domande
+            Tupla di domande (sola lettura)
         """
         
         return self.questions
@@ -62,7 +85,10 @@ class CompleteQuizEngine:
             answer: risposta selezionata dall'utente
         """        
         
+        # Il contatore cambia solo quando la domanda passa da senza risposta a con risposta (o viceversa)
+        self._answered_count += bool(answer) - bool(self.user_answers.get(cod_domanda))
         self.user_answers[cod_domanda] = answer
+        self._normalized_answers[cod_domanda] = normalize_answer(answer).encode('utf-8') if answer else b''
     
     def get_saved_answer(self, cod_domanda: str) -> Optional[str]:
         """
@@ -80,6 +106,21 @@ class CompleteQuizEngine:
         """
         Valuta tutte le risposte e calcola il risultato
         
+        Returns:
+            Oggetto CompleteQuizResult con i risultati dettagliati
+        """
+        # Nessuna risposta salvata: il risultato non dipende dall'utente e si riusa
+        if not self.user_answers:
+            if self._empty_result is None:
+                self._empty_result = self._evaluate_answers()
+            return self._empty_result
+        
+        return self._evaluate_answers()
+    
+    def _evaluate_answers(self) -> CompleteQuizResult:
+        """
+        Confronta le risposte salvate con quelle corrette
+        
         Returns:
             Oggetto CompleteQuizResult con i risultati dettagliati
         """
@@ -87,15 +128,16 @@ class CompleteQuizEngine:
         wrong = 0
         question_results = []
         
-        for idx, question in enumerate(self.questions):
-            user_answer = self.user_answers.get(question["cod_domanda"])
-            correct_answer = question["risposta_corretta"]
+        for cod_domanda, domanda, correct_answer, correct_norm in zip(
+            self._codes, self._domande, self._correct_answers, self._correct_norm
+        ):
+            user_answer = self.user_answers.get(cod_domanda)
             
-            # Confronto case-insensitive con strip (gestisce None)
-            if user_answer is None or user_answer == "":
-                is_correct = False
-            else:
-                is_correct = user_answer.strip().lower() == correct_answer.strip().lower()
+            # Confronto su risposte già normalizzate al salvataggio (gestisce None e "").
+            # compare_digest non interrompe il confronto al primo carattere diverso
+            is_correct = bool(user_answer) and hmac.compare_digest(
+                self._normalized_answers[cod_domanda], correct_norm
+            )
             
             if is_correct:
                 correct += 1
@@ -103,8 +145,8 @@ class CompleteQuizEngine:
                 wrong += 1
             
             question_results.append({
-                "cod_domanda": question["cod_domanda"],
-                "domanda": question["domanda"],
+                "cod_domanda": cod_domanda,
+                "domanda": domanda,
                 "user_answer": user_answer if user_answer is not None else "(Non hai risposto)",
                 "correct_answer": correct_answer,
                 "is_correct": is_correct
@@ -120,6 +162,30 @@ class CompleteQuizEngine:
             question_results=question_results
         )
     
+    def evaluate_batch(self, user_answers_list: List[Dict[str, str]]) -> List[int]:
+        """
+        Conta le risposte corrette di più utenti sullo stesso quiz (es. report di classe),
+        senza costruire il dettaglio per domanda
+
+        Args:
+            user_answers_list: lista di dizionari cod_domanda -> risposta, uno per utente
+
+        Returns:
+            Numero di risposte corrette per ogni utente, nello stesso ordine
+        """
+        questions = list(zip(self._codes, self._correct_norm))
+        correct_counts = []
+
+        for answers in user_answers_list:
+            correct = 0
+            for cod_domanda, correct_norm in questions:
+                user_answer = answers.get(cod_domanda)
+                if user_answer and hmac.compare_digest(normalize_answer(user_answer).encode('utf-8'), correct_norm):
+                    correct += 1
+            correct_counts.append(correct)
+
+        return correct_counts
+
     def is_complete(self) -> bool:
         """
         Verifica se tutte le domande hanno una risposta
@@ -127,17 +193,19 @@ class CompleteQuizEngine:
         Returns:
             True se tutte le domande sono state risposte
         """
-        return len(self.user_answers) == self.total_questions
+        return self._answered_count == self.total_questions
     
     def get_answered_count(self) -> int:
         """
         Numero di domande a cui è stata data una risposta
         
         Returns:
-            Numero di risposte salvate
+            Numero di risposte salvate (non vuote)
         """
-        return len(self.user_answers)
+        return self._answered_count
     
     def reset(self):
         """Resetta tutte le risposte"""
         self.user_answers = {}
+        self._normalized_answers = {}
+        self._answered_count = 0
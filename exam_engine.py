@@ -7,14 +7,35 @@ Gestisce:
 - Calcolo punteggio finale
 """
 
+import functools
 import random
 import time
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 
+from quiz_engine import normalize_answer
 
-@dataclass
+# Riferimenti locali alle funzioni usate a ogni costruzione/aggiornamento del timer
+_sample = random.sample
+_now = time.monotonic
+
+
+@functools.lru_cache(maxsize=32)
+def _display_name(module_name: str) -> str:
+    """
+    Estrae un nome leggibile dal filename del modulo (es. "farmacologia_clinica_final.json" -> "Farmacologia Clinica")
+    
+    Args:
+        module_name: nome del file del modulo
+        
+    Returns:
+        Nome del modulo da mostrare, usato anche come chiave di QUESTIONS_AND_TIMES_PER_MODULE
+    """
+    return module_name.replace("_final.json", "").replace("_", " ").title()
+
+
+@dataclass(slots=True)
 class ModuleResult:
     """Risultato di un singolo modulo d'esame"""
     module_name: str
@@ -25,7 +46,7 @@ class ModuleResult:
     completed: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class ExamResult:
     """Risultato complessivo dell'esame"""
     module_results: List[ModuleResult]
@@ -56,79 +77,103 @@ class ExamModuleEngine:
             module_name: nome del modulo
             questions: pool completo di domande del modulo
         """        
-        if len(questions) < self.QUESTIONS_AND_TIMES_PER_MODULE.get(module_name, self.DEFAULT_VALUE):
+        n_questions = self.QUESTIONS_AND_TIMES_PER_MODULE.get(module_name, self.DEFAULT_VALUE)
+        if len(questions) < n_questions:
             raise ValueError(
                 f"Not enough questions for exam module. "
-                f"Required: {self.QUESTIONS_AND_TIMES_PER_MODULE[module_name]}, available: {len(questions)}"
+                f"Required: {n_questions}, available: {len(questions)}"
             )
         
         self.module_name = module_name
+        # Tempo a disposizione (un minuto per domanda), letto una volta sola
+        self._time_limit_s = n_questions * 60
         
         # Seleziona QUESTIONS_AND_TIMES_PER_MODULE domande random
-        self.questions = random.sample(questions, self.QUESTIONS_AND_TIMES_PER_MODULE.get(module_name, self.DEFAULT_VALUE))
+        self.questions = _sample(questions, n_questions)
+        
+        # Numero di domande del modulo, fisso dopo il campionamento
+        self._n = len(self.questions)
+        
+        # Codici domanda e risposte corrette normalizzate calcolati una sola volta (le domande non cambiano più)
+        self._cod_domande = [q.get("cod_domanda", str(i)) for i, q in enumerate(self.questions)]
+        self._correct_norm = [normalize_answer(q["risposta_corretta"]) for q in self.questions]
+        
+        # Domande con i metadati di posizione, costruite una volta invece che a ogni richiesta della UI
+        # (cod_domanda resta quello del JSON)
+        self._question_views = [
+            {**q, "question_number": i + 1, "total_questions": self._n}
+            for i, q in enumerate(self.questions)
+        ]
         
         # Risposte dell'utente (key: cod_domanda, value: risposta)
         self.user_answers: Dict[str, str] = {}
+        # Punteggio aggiornato a ogni salvataggio: esito dell'ultima risposta per domanda
+        # e numero di risposte corrette (le risposte vuote contano come errate)
+        self._was_correct: Dict[str, bool] = {}
+        self._correct_count = 0
         
-        # Timer
+        # Timer (time.monotonic: non risente di aggiustamenti dell'orologio di sistema)
         self.start_time: Optional[float] = None
         self.end_time: Optional[float] = None
+        self._deadline: Optional[float] = None
         
         # Indice domanda corrente
         self.current_question_idx = 0
         
     def start_timer(self):
         """Avvia il timer del modulo"""
-        self.start_time = time.time()
+        self.start_time = _now()
         self.end_time = None  # Reset end_time quando si riavvia il timer
+        self._deadline = self.start_time + self._time_limit_s
          # print(f"[Debug ExamEngine] Timer started for module {self.module_name} at {self.start_time}")
     
-    def get_elapsed_seconds(self) -> int:
+    def get_elapsed_seconds(self) -> float:
         """
         Calcola i secondi trascorsi dall'inizio
         
         Returns:
-            Secondi trascorsi
+            Secondi trascorsi (non arrotondati: la UI arrotonda quando li mostra)
         """
         if self.start_time is None:
-            return 0
+            return 0.0
         
         if self.end_time is not None:
-            return int(self.end_time - self.start_time)
+            return self.end_time - self.start_time
         
-        return int(time.time() - self.start_time)
+        return _now() - self.start_time
     
-    def get_remaining_seconds(self, module_name) -> int:
+    def get_remaining_seconds(self) -> float:
         """
         Calcola i secondi rimanenti
         
         Returns:
-            Secondi rimanenti (0 se il tempo è scaduto)
+            Secondi rimanenti (0 se il tempo è scaduto; non arrotondati)
         """
-        elapsed = self.get_elapsed_seconds()
-        remaining = self.QUESTIONS_AND_TIMES_PER_MODULE.get(module_name, self.DEFAULT_VALUE)*60 - elapsed
-        return max(0, remaining)
+        if self._deadline is None:
+            return float(self._time_limit_s)
+        
+        now = self.end_time if self.end_time is not None else _now()
+        return max(0.0, self._deadline - now)
     
-    def is_time_expired(self, module_name) -> bool:
+    def is_time_expired(self) -> bool:
         """Verifica se il tempo è scaduto"""
-        return self.get_remaining_seconds(module_name) == 0
+        if self._deadline is None:
+            return False
+        
+        now = self.end_time if self.end_time is not None else _now()
+        return now >= self._deadline
     
     def get_current_question(self) -> Optional[Dict[str, Any]]:
         """
         Restituisce la domanda corrente
         
         Returns:
-            Dizionario con la domanda e metadata
+            Dizionario con la domanda e metadata (condiviso, da non modificare)
         """
-        if self.current_question_idx >= len(self.questions):
+        if self.current_question_idx >= self._n:
             return None
         
-        question = self.questions[self.current_question_idx].copy()
-        # Preserva cod_domanda dal JSON, non sovrascriverlo
-        question["question_number"] = self.current_question_idx + 1
-        question["total_questions"] = len(self.questions)
-        
-        return question
+        return self._question_views[self.current_question_idx]
     
     def save_current_answer(self, answer: str):
         """
@@ -137,10 +182,14 @@ class ExamModuleEngine:
         Args:
             answer: risposta selezionata dall'utente
         """
-        current_question = self.questions[self.current_question_idx]
-        cod_domanda = current_question.get("cod_domanda", str(self.current_question_idx))
+        cod_domanda = self._cod_domande[self.current_question_idx]
          # print(f"[Debug ExamEngine] Saving answer for cod_domanda={cod_domanda}, answer={answer}")
         self.user_answers[cod_domanda] = answer
+        
+        # Sovrascrivere una risposta toglie l'esito precedente prima di aggiungere il nuovo
+        is_correct = bool(answer) and normalize_answer(answer) == self._correct_norm[self.current_question_idx]
+        self._correct_count += is_correct - self._was_correct.get(cod_domanda, False)
+        self._was_correct[cod_domanda] = is_correct
          # print(f"[Debug ExamEngine] Total answers saved: {len(self.user_answers)}")
     
     def next_question(self) -> bool:
@@ -150,7 +199,7 @@ class ExamModuleEngine:
         Returns:
             True se c'è una domanda successiva, False se siamo all'ultima
         """
-        if self.current_question_idx < len(self.questions) - 1:
+        if self.current_question_idx < self._n - 1:
             self.current_question_idx += 1
             return True
         return False
@@ -174,15 +223,13 @@ class ExamModuleEngine:
         Args:
             question_idx: indice della domanda (0-based)
         """
-        if 0 <= question_idx < len(self.questions):
+        if 0 <= question_idx < self._n:
             self.current_question_idx = question_idx
     
     def get_saved_answer(self, question_idx: int) -> Optional[str]:
         """Recupera la risposta salvata per una domanda specifica (usa idx per compatibilità UI)"""
-        if question_idx < len(self.questions):
-            question = self.questions[question_idx]
-            cod_domanda = question.get("cod_domanda", str(question_idx))
-            return self.user_answers.get(cod_domanda)
+        if question_idx < self._n:
+            return self.user_answers.get(self._cod_domande[question_idx])
         return None
     
     def get_answered_count(self) -> int:
@@ -197,37 +244,21 @@ class ExamModuleEngine:
             Oggetto ModuleResult con i risultati
         """
         if self.end_time is None:
-            self.end_time = time.time()
+            self.end_time = _now()
         
          # print(f"[Debug ExamEngine] finish_module called - Total questions: {len(self.questions)}")
          # print(f"[Debug ExamEngine] Total user answers: {len(self.user_answers)}")
          # print(f"[Debug ExamEngine] User answers: {self.user_answers}")
         
-        correct = 0
-        for idx, question in enumerate(self.questions):
-            cod_domanda = question.get("cod_domanda", str(idx))
-            user_answer = self.user_answers.get(cod_domanda)
-            correct_answer = question["risposta_corretta"]
-            
-             # print(f"[Debug ExamEngine] Q{idx+1} cod={cod_domanda}, user={user_answer}, correct={correct_answer}")
-            
-            # Gestisce None nelle risposte
-            if user_answer is None or user_answer == "":
-                is_correct = False
-            else:
-                is_correct = user_answer.strip().lower() == correct_answer.strip().lower()
-            
-             # print(f"[Debug ExamEngine] Q{idx+1} is_correct={is_correct}")
-            
-            if is_correct:
-                correct += 1
-        
-        score_percentage = (correct / len(self.questions) * 100) if len(self.questions) > 0 else 0
-        time_spent = self.get_elapsed_seconds()
+        # Il punteggio è già aggiornato da save_current_answer
+        correct = self._correct_count
+        
+        score_percentage = (correct / self._n * 100) if self._n > 0 else 0
+        time_spent = int(self.get_elapsed_seconds())
         
         return ModuleResult(
             module_name=self.module_name,
-            total_questions=len(self.questions),
+            total_questions=self._n,
             correct_answers=correct,
             score_percentage=score_percentage,
             time_spent_seconds=time_spent,
@@ -241,6 +272,8 @@ class ExamEngine:
     Gestisce multipli moduli in sequenza.
     """
     
+    __slots__ = ("module_names", "module_engines", "current_module_idx", "module_results", "_progress_cache")
+    
     def __init__(self, modules_data: Dict[str, List[Dict[str, Any]]]):
         """
         Inizializza l'esame con i moduli selezionati
@@ -251,23 +284,36 @@ class ExamEngine:
         if not modules_data:
             raise ValueError("Cannot initialize exam with no modules")
         
-        self.module_names = list(modules_data.keys())
-        self.module_engines: List[ExamModuleEngine] = []
+        self.module_names = tuple(modules_data.keys())
         
-        # Crea un engine per ogni modulo
+        # Verifica tutti i moduli prima di crearne gli engine, così un errore
+        # li segnala tutti insieme invece di fermarsi al primo
+        plan = []
+        errors = []
         for module_name, questions in modules_data.items():
-            try:
-                # Estrae un nome leggibile dal filename
-                display_name = module_name.replace("_final.json", "").replace("_", " ").title()
-                #print(f"This is the display name: {display_name}")
-                engine = ExamModuleEngine(display_name, questions)
-                self.module_engines.append(engine)
-            except ValueError as e:
-                raise ValueError(f"Error initializing module {module_name}: {str(e)}")
+            display_name = _display_name(module_name)
+            required = ExamModuleEngine.QUESTIONS_AND_TIMES_PER_MODULE.get(display_name, ExamModuleEngine.DEFAULT_VALUE)
+            if len(questions) < required:
+                errors.append(
+                    f"Error initializing module {module_name}: Not enough questions for exam module. "
+                    f"Required: {required}, available: {len(questions)}"
+                )
+            plan.append((display_name, questions))
+        
+        if errors:
+            raise ValueError("; ".join(errors))
+        
+        # Crea un engine per ogni modulo (l'elenco non cambia più dopo l'inizializzazione)
+        self.module_engines: Tuple[ExamModuleEngine, ...] = tuple(
+            ExamModuleEngine(display_name, questions) for display_name, questions in plan
+        )
         
         self.current_module_idx = 0
         self.module_results: List[ModuleResult] = []
         
+        # Ultimo avanzamento calcolato, valido finché (modulo corrente, moduli completati) non cambia
+        self._progress_cache: Optional[Tuple[Tuple[int, int], Dict[str, Any]]] = None
+        
     def get_current_module(self) -> Optional[ExamModuleEngine]:
         """
         Restituisce l'engine del modulo corrente
@@ -319,12 +365,20 @@ class ExamEngine:
         Returns:
             Dizionario con modulo corrente, totale moduli, ecc.
         """
-        return {
+        # next_module e finish_current_module cambiano la chiave: non serve invalidare a mano
+        key = (self.current_module_idx, len(self.module_results))
+        if self._progress_cache is not None and self._progress_cache[0] == key:
+            return self._progress_cache[1]
+        
+        current_module = self.get_current_module()
+        progress = {
             "current_module": self.current_module_idx + 1,
             "total_modules": len(self.module_engines),
             "completed_modules": len(self.module_results),
-            "current_module_name": self.get_current_module().module_name if self.get_current_module() else None
+            "current_module_name": current_module.module_name if current_module else None
         }
+        self._progress_cache = (key, progress)
+        return progress
     
     def get_final_results(self) -> ExamResult:
         """
@@ -333,10 +387,12 @@ class ExamEngine:
         Returns:
             Oggetto ExamResult con tutti i risultati
         """
-        total_correct = sum(r.correct_answers for r in self.module_results)
-        total_questions = sum(r.total_questions for r in self.module_results)
-        
-        total_time = sum(r.time_spent_seconds for r in self.module_results)
+        # Un solo passaggio sui risultati per tutti e tre i totali
+        total_correct = total_questions = total_time = 0
+        for r in self.module_results:
+            total_correct += r.correct_answers
+            total_questions += r.total_questions
+            total_time += r.time_spent_seconds
         
         return ExamResult(
             module_results=self.module_results,
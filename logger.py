@@ -3,6 +3,7 @@ Modulo per il logging delle risposte degli utenti.
 Gestisce:
 - Salvataggio di ogni interazione utente-quiz su Google Sheets
 - Persistenza su foglio Google (log_streamlit) con due fogli separati
+- Fallback locale su database SQLite (quiz_logs.db)
 - Query sui dati storici
 - Conversione automatica CSV->JSON per compatibilità
 
@@ -20,15 +21,23 @@ Struttura log:
 }
 """
 
+import atexit
 import json
+import queue
+import random
 import csv
 import io
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 import pandas as pd
 import streamlit as st
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+from dataclasses import dataclass
 
 # Google Sheets imports (usando connettore ufficiale Streamlit)
 try:
@@ -38,10 +47,10 @@ except ImportError:
     GSHEETS_AVAILABLE = False
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class QuizLogEntry:
     """Singola entry nel log delle risposte"""
-    timestamp: str
+    timestamp: int  # time.time_ns(); convertito in ISO solo quando viene letto o inviato a Sheets
     username: str
     quiz_mode: str  # "single_question", "complete", "exam"
     module_name: str
@@ -51,31 +60,580 @@ class QuizLogEntry:
     is_correct: bool
     attempt_number: int = 1
     session_id: Optional[str] = None  # Per raggruppare risposte della stessa sessione
+    
+    def as_dict(self) -> Dict[str, Any]:
+        """Dizionario dei campi (la struttura è piatta: basta leggere gli slot, senza la copia ricorsiva di asdict)"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+# Schema del database locale: risposte e riepiloghi di sessione in tabelle separate,
+# così le statistiche leggono solo quiz_answers, senza filtrare le righe di riepilogo.
+# Il riepilogo è serializzato in JSON nella colonna summary.
+_LOCAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quiz_answers (
+    id INTEGER PRIMARY KEY,
+    timestamp INTEGER,
+    username TEXT,
+    quiz_mode TEXT,
+    module_name TEXT,
+    question_id INTEGER,
+    user_answer TEXT,
+    correct_answer TEXT,
+    is_correct INTEGER,
+    attempt_number INTEGER,
+    session_id TEXT
+);
+-- Indice coprente per utente: get_user_stats legge solo l'indice, senza accedere alla tabella
+-- (il GROUP BY per modulo usa comunque un ordinamento temporaneo, perché l'unione con l'archivio
+-- non conserva l'ordine); serve anche lo storico. Le statistiche di domanda e modulo leggono quiz_stats
+CREATE INDEX IF NOT EXISTS idx_quiz_answers_user ON quiz_answers(username, module_name, is_correct, user_answer);
+
+CREATE TABLE IF NOT EXISTS quiz_summaries (
+    id INTEGER PRIMARY KEY,
+    timestamp INTEGER,
+    username TEXT,
+    quiz_mode TEXT,
+    session_id TEXT,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_quiz_summaries_username ON quiz_summaries(username);
+
+-- Contatori per domanda, aggiornati dal trigger nella stessa transazione di ogni insert:
+-- le statistiche di domanda/modulo non devono più scorrere lo storico
+CREATE TABLE IF NOT EXISTS quiz_stats (
+    module_name TEXT,
+    question_id INTEGER,
+    total INTEGER NOT NULL,
+    correct INTEGER NOT NULL,
+    PRIMARY KEY (module_name, question_id)
+);
+CREATE TABLE IF NOT EXISTS quiz_stat_users (
+    module_name TEXT,
+    question_id INTEGER,
+    username TEXT,
+    PRIMARY KEY (module_name, question_id, username)
+);
+CREATE TRIGGER IF NOT EXISTS trg_quiz_answers_stats AFTER INSERT ON quiz_answers
+BEGIN
+    INSERT INTO quiz_stats (module_name, question_id, total, correct)
+    VALUES (NEW.module_name, NEW.question_id, 1, COALESCE(NEW.is_correct, 0))
+    ON CONFLICT (module_name, question_id) DO UPDATE SET
+        total = total + 1,
+        correct = correct + excluded.correct;
+    INSERT OR IGNORE INTO quiz_stat_users (module_name, question_id, username)
+    VALUES (NEW.module_name, NEW.question_id, NEW.username);
+END;
+"""
+
+# Le scritture su Google Sheets passano da una coda svuotata da un thread in background, che le
+# invia insieme quando il blocco raggiunge questa dimensione, quando è passato l'intervallo (secondi)
+# dalla prima entry del blocco, a fine sessione o all'uscita del processo: una chiamata API per
+# blocco invece di una per risposta, e nessuna attesa di rete sul thread della pagina
+_SHEETS_BATCH_SIZE = 20
+_SHEETS_FLUSH_INTERVAL = 30.0
+
+# Segnale in coda: il thread di scrittura invia subito il blocco corrente
+_FLUSH = object()
+
+# Tentativi di scrittura su Sheets quando la quota è superata (HTTP 429), con attese di 1, 2, 4, 8 s
+# più jitter: circa 15 s, sufficienti a superare la finestra di un minuto insieme ai blocchi da 20.
+# Esauriti i tentativi, le entry finiscono nel database locale
+_SHEETS_MAX_ATTEMPTS = 5
+
+# Risposte oltre questo numero vengono spostate (dalle più vecchie) nel database di archivio,
+# così tabella e indici "caldi" restano piccoli. quiz_stats conserva comunque i totali storici
+_HOT_ANSWERS_LIMIT = 50_000
+
+# Database di archivio, collegato come "archive" alla connessione locale. Le righe archiviate hanno
+# un proprio id e conservano quello originale in answer_id: un id già presente nell'archivio (database
+# principale ricreato, crash tra archiviazione e salvataggio in memoria) non blocca le rotazioni successive.
+# La vista temporanea all_answers unisce risposte recenti e archiviate per lo storico utente
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive.quiz_answers (
+    id INTEGER PRIMARY KEY,
+    answer_id INTEGER,
+    timestamp INTEGER,
+    username TEXT,
+    quiz_mode TEXT,
+    module_name TEXT,
+    question_id INTEGER,
+    user_answer TEXT,
+    correct_answer TEXT,
+    is_correct INTEGER,
+    attempt_number INTEGER,
+    session_id TEXT
+);
+CREATE INDEX IF NOT EXISTS archive.idx_quiz_answers_user ON quiz_answers(username, module_name, is_correct, user_answer);
+CREATE TEMP VIEW IF NOT EXISTS all_answers AS
+SELECT * FROM main.quiz_answers
+UNION ALL
+SELECT answer_id, timestamp, username, quiz_mode, module_name, question_id, user_answer,
+    correct_answer, is_correct, attempt_number, session_id
+FROM archive.quiz_answers;
+"""
+
+# Sposta le risposte con id fino a ?1 (il più recente da archiviare) nel database di archivio
+_ROTATE_ANSWERS_SQL = (
+    "INSERT INTO archive.quiz_answers ("
+    "answer_id, timestamp, username, quiz_mode, module_name, question_id, user_answer, "
+    "correct_answer, is_correct, attempt_number, session_id) "
+    "SELECT id, timestamp, username, quiz_mode, module_name, question_id, user_answer, "
+    "correct_answer, is_correct, attempt_number, session_id "
+    "FROM main.quiz_answers WHERE id <= ?",
+    "DELETE FROM main.quiz_answers WHERE id <= ?"
+)
+
+# Conteggi per modulo di un utente su risposte recenti e archiviate. Le colonne sono elencate
+# in ogni ramo (invece di leggere all_answers) perché entrambi usino solo l'indice per utente
+_USER_STATS_SQL = """
+SELECT module_name, SUM(answered), COALESCE(SUM(is_correct), 0) FROM (
+    SELECT module_name, user_answer IS NOT '(Non hai risposto)' AS answered, is_correct
+    FROM main.quiz_answers WHERE username = ?1
+    UNION ALL
+    SELECT module_name, user_answer IS NOT '(Non hai risposto)', is_correct
+    FROM archive.quiz_answers WHERE username = ?1
+)
+GROUP BY module_name
+"""
+
+# Impostazioni del database locale, adatte a un carico di log (molti insert piccoli):
+# WAL evita la doppia scrittura del rollback journal e non blocca le letture durante gli insert,
+# synchronous=NORMAL con WAL salta un fsync per commit (al peggio si perdono gli ultimi log
+# in caso di crash del sistema, mai la consistenza del file), mmap e cache velocizzano le letture.
+_LOCAL_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA mmap_size=268435456;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-20000;
+"""
+
+_INSERT_ANSWER_SQL = """
+INSERT INTO quiz_answers (
+    timestamp, username, quiz_mode, module_name, question_id, user_answer,
+    correct_answer, is_correct, attempt_number, session_id
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_SUMMARY_SQL = """
+INSERT INTO quiz_summaries (timestamp, username, quiz_mode, session_id, summary)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+# Storico di un utente: risposte e riepiloghi nello stesso formato di riga, in ordine cronologico.
+# I timestamp testuali (log importati dal vecchio JSON) sono i più vecchi e vengono prima
+_USER_HISTORY_SQL = """
+SELECT * FROM (
+    SELECT timestamp, username, quiz_mode, module_name, question_id, user_answer,
+        correct_answer, is_correct, attempt_number, session_id, NULL AS type, NULL AS summary
+    FROM all_answers WHERE username = ?1
+    UNION ALL
+    SELECT timestamp, username, quiz_mode, NULL, NULL, NULL,
+        NULL, NULL, NULL, session_id, 'session_summary', summary
+    FROM quiz_summaries WHERE username = ?1
+)
+ORDER BY typeof(timestamp) <> 'text', timestamp
+"""
+
+# Campi di una risposta, nell'ordine di QuizLogEntry
+_ANSWER_FIELDS = (
+    "timestamp", "username", "quiz_mode", "module_name", "question_id", "user_answer",
+    "correct_answer", "is_correct", "attempt_number", "session_id"
+)
+
+
+# Colonne del foglio answers lette dalle statistiche (le altre non vengono scaricate)
+_STATS_COLUMNS = ("username", "module_name", "question_id", "user_answer", "is_correct")
+
+
+# Copie in memoria dei database locali (in_memory=True), una per file e condivise da tutte
+# le istanze: copie separate dello stesso file si sovrascriverebbero a vicenda su disco
+_memory_dbs: Dict[str, Tuple[sqlite3.Connection, sqlite3.Connection]] = {}
+
+# Lock dei database locali, uno per file: la connessione è condivisa tra i thread delle
+# sessioni Streamlit (e, in memoria, tra le istanze) e sqlite3 non serializza l'accesso
+_db_locks: Dict[str, threading.RLock] = {}
+
+
+def _db_lock_for(log_file: Path) -> threading.RLock:
+    """
+    Restituisce il lock che serializza l'accesso al database locale indicato
+    
+    Args:
+        log_file: percorso del database su disco
+        
+    Returns:
+        Lock (rientrante) condiviso da tutte le connessioni allo stesso file
+    """
+    return _db_locks.setdefault(str(log_file.resolve()), threading.RLock())
+
+
+def _backup_locked(memory: sqlite3.Connection, disk: sqlite3.Connection, lock: threading.RLock):
+    """Copia su disco un database in memoria tenendo il lock della connessione"""
+    with lock:
+        memory.backup(disk)
+
+
+def _open_memory_db(log_file: Path) -> Tuple[sqlite3.Connection, sqlite3.Connection]:
+    """
+    Restituisce la copia in memoria di un database locale, caricandola dal file alla prima richiesta
+    
+    Args:
+        log_file: percorso del database su disco
+        
+    Returns:
+        Coppia (connessione in memoria, connessione al file su disco)
+    """
+    key = str(log_file.resolve())
+    if key not in _memory_dbs:
+        disk = sqlite3.connect(key, check_same_thread=False)
+        memory = sqlite3.connect(":memory:", check_same_thread=False)
+        disk.backup(memory)
+        # Ultimo salvataggio all'uscita del processo
+        atexit.register(_backup_locked, memory, disk, _db_lock_for(log_file))
+        _memory_dbs[key] = (memory, disk)
+    return _memory_dbs[key]
+
+
+# Durata (secondi) della cache delle letture da Google Sheets, condivisa tra sessioni e rerun
+_LOGS_CACHE_TTL = 60
+
+
+@st.cache_data(ttl=_LOGS_CACHE_TTL, show_spinner=False)
+def _read_worksheet_cached(_conn, spreadsheet: str, worksheet_name: str):
+    """
+    Legge un intero foglio di log, con cache TTL
+    
+    Args:
+        _conn: connessione a Google Sheets (esclusa dalla chiave di cache)
+        spreadsheet: file Google Sheets dei log (lo stesso in cui scrive il logger)
+        worksheet_name: "answers" o "sessions"
+        
+    Returns:
+        DataFrame con il contenuto del foglio
+    """
+    return _conn.read(spreadsheet=spreadsheet, worksheet=worksheet_name, ttl=0)
+
+
+@st.cache_data(ttl=_LOGS_CACHE_TTL, show_spinner=False)
+def _query_worksheet_cached(_conn, spreadsheet: str, worksheet_name: str, sql: str):
+    """
+    Esegue una query SQL su un foglio di log, con cache TTL (i filtri fanno parte della query, quindi della chiave)
+    
+    Args:
+        _conn: connessione a Google Sheets (esclusa dalla chiave di cache)
+        spreadsheet: file Google Sheets dei log (lo stesso in cui scrive il logger)
+        worksheet_name: "answers" o "sessions"
+        sql: query da eseguire
+        
+    Returns:
+        DataFrame con il risultato della query
+    """
+    return _conn.query(spreadsheet=spreadsheet, worksheet=worksheet_name, sql=sql, ttl=0)
+
+
+@st.cache_data(ttl=_LOGS_CACHE_TTL, show_spinner=False)
+def _read_columns_cached(_worksheet, spreadsheet: str, worksheet_name: str, columns: Tuple[str, ...]) -> pd.DataFrame:
+    """
+    Legge solo alcune colonne di un foglio di log (batch_get sugli intervalli di colonna), con cache TTL
+    
+    Args:
+        _worksheet: worksheet gspread (escluso dalla chiave di cache)
+        spreadsheet: file Google Sheets del foglio (solo per la chiave di cache)
+        worksheet_name: "answers" o "sessions"
+        columns: colonne da leggere
+        
+    Returns:
+        DataFrame con le colonne richieste (valori come testo)
+    """
+    # Posizione delle colonne secondo l'intestazione scritta dal logger (meno di 26 colonne: una lettera)
+    headers = _SHEETS_HEADERS[worksheet_name]
+    letters = [chr(ord("A") + headers.index(column)) for column in columns]
+    value_ranges = _worksheet.batch_get([f"{letter}:{letter}" for letter in letters])
+    
+    data = {}
+    for column, values in zip(columns, value_ranges):
+        # La prima cella è l'intestazione: un foglio con colonne in altro ordine non viene letto
+        if not values or values[0][:1] != [column]:
+            raise ValueError(f"Colonna {column} non trovata nel foglio {worksheet_name}")
+        data[column] = [row[0] if row else None for row in values[1:]]
+    
+    # Le celle vuote in fondo a una colonna non vengono restituite: si allinea alla più lunga
+    n_rows = max(len(values) for values in data.values())
+    return pd.DataFrame({column: values + [None] * (n_rows - len(values)) for column, values in data.items()})
+
+
+def _clear_logs_cache():
+    """Invalida la cache delle letture dei log (da chiamare dopo ogni scrittura sul foglio)"""
+    _read_worksheet_cached.clear()
+    _query_worksheet_cached.clear()
+    _read_columns_cached.clear()
+
+
+def _sql_literal(value: str) -> str:
+    """
+    Rende un valore una stringa SQL letterale sicura (il connettore non supporta parametri)
+    
+    Args:
+        value: valore da inserire nella query
+        
+    Returns:
+        Valore tra apici singoli, con gli apici interni raddoppiati
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _format_timestamp(timestamp: Any) -> Any:
+    """
+    Converte un timestamp in nanosecondi (time.time_ns) nella stringa ISO usata nei log
+    
+    Args:
+        timestamp: nanosecondi dall'epoch, oppure un valore già in formato ISO (log importati)
+        
+    Returns:
+        Timestamp in formato ISO (i valori non interi sono restituiti invariati)
+    """
+    if isinstance(timestamp, int):
+        return datetime.fromtimestamp(timestamp / 1e9).isoformat()
+    return timestamp
+
+
+def _summary_json(summary: Dict[str, Any]) -> str:
+    """Serializza il riepilogo di sessione per la colonna summary_json del foglio sessions"""
+    return json.dumps(summary, ensure_ascii=False)
+
+
+# Colonne dei fogli Google Sheets, nell'ordine del foglio:
+# (intestazione, chiave della entry, valore predefinito, conversione o None)
+_SHEETS_COLUMNS = {
+    "answers": (
+        ("timestamp", "timestamp", "", _format_timestamp),
+        ("username", "username", "", None),
+        ("quiz_mode", "quiz_mode", "", None),
+        ("module_name", "module_name", "", None),
+        ("question_id", "question_id", 0, None),
+        ("user_answer", "user_answer", "", None),
+        ("correct_answer", "correct_answer", "", None),
+        ("is_correct", "is_correct", False, str),
+        ("attempt_number", "attempt_number", 1, None),
+        ("session_id", "session_id", "", None),
+    ),
+    "sessions": (
+        ("timestamp", "timestamp", "", _format_timestamp),
+        ("username", "username", "", None),
+        ("quiz_mode", "quiz_mode", "", None),
+        ("session_id", "session_id", "", None),
+        ("type", "type", "session_summary", None),
+        ("summary_json", "summary", {}, _summary_json),
+    ),
+}
+
+_SHEETS_HEADERS = {
+    worksheet_name: [header for header, _, _, _ in columns]
+    for worksheet_name, columns in _SHEETS_COLUMNS.items()
+}
+
+
+def _sheet_rows(entries: List[Dict[str, Any]], worksheet_name: str) -> List[list]:
+    """
+    Converte le entry nelle righe da aggiungere a un foglio Google Sheets
+    
+    Args:
+        entries: dizionari con i dati, tutti dello stesso tipo
+        worksheet_name: "answers" o "sessions"
+        
+    Returns:
+        Una lista di valori per entry, nell'ordine di _SHEETS_COLUMNS
+    """
+    columns = _SHEETS_COLUMNS[worksheet_name]
+    return [
+        [
+            convert(entry.get(key, default)) if convert else entry.get(key, default)
+            for _, key, default, convert in columns
+        ]
+        for entry in entries
+    ]
+
+
+def _coerce_answer_types(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converte i tipi delle colonne lette dal foglio answers (il foglio restituisce testo)
+    
+    Args:
+        df: DataFrame con (tutte o parte delle) righe del foglio answers, modificato sul posto
+        
+    Returns:
+        Lo stesso DataFrame
+    """
+    # Converti tipi di dati per colonna (operazioni vettoriali, non un ciclo per record)
+    # is_correct da stringa a booleano
+    if 'is_correct' in df.columns:
+        df['is_correct'] = df['is_correct'].astype(str).str.lower().eq('true')
+    # question_id e attempt_number a int (valori non numerici -> 0 e 1)
+    if 'question_id' in df.columns:
+        df['question_id'] = pd.to_numeric(df['question_id'], errors='coerce').fillna(0).astype('int64')
+    if 'attempt_number' in df.columns:
+        df['attempt_number'] = pd.to_numeric(df['attempt_number'], errors='coerce').fillna(1).astype('int64')
+    
+    return df
+
+
+def _answers_to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Converte le righe lette dal foglio answers in log entries con i tipi corretti
+    
+    Args:
+        df: DataFrame con (tutte o parte delle) righe del foglio answers
+        
+    Returns:
+        Lista di log entries
+    """
+    return _coerce_answer_types(df).to_dict('records')
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    """Indica se un errore delle API Google (gspread APIError) è un superamento di quota (HTTP 429)"""
+    return getattr(getattr(error, "response", None), "status_code", None) == 429
+
+
+def _is_summary(entry: Dict[str, Any]) -> bool:
+    """Indica se una entry di log è un riepilogo di sessione (altrimenti è una risposta)"""
+    return entry.get("type") == "session_summary"
+
+
+def _answer_to_row(entry: Dict[str, Any]) -> tuple:
+    """
+    Converte una risposta nella riga da inserire nel database locale
+    
+    Args:
+        entry: dizionario della risposta
+        
+    Returns:
+        Tupla di valori nell'ordine di _INSERT_ANSWER_SQL
+    """
+    return (
+        entry.get("timestamp"),
+        entry.get("username"),
+        entry.get("quiz_mode"),
+        entry.get("module_name"),
+        entry.get("question_id"),
+        entry.get("user_answer"),
+        entry.get("correct_answer"),
+        int(entry["is_correct"]) if "is_correct" in entry else None,
+        entry.get("attempt_number"),
+        entry.get("session_id")
+    )
+
+
+def _summary_to_row(entry: Dict[str, Any]) -> tuple:
+    """
+    Converte un riepilogo di sessione nella riga da inserire nel database locale
+    
+    Args:
+        entry: dizionario del riepilogo
+        
+    Returns:
+        Tupla di valori nell'ordine di _INSERT_SUMMARY_SQL
+    """
+    summary = entry.get("summary")
+    return (
+        entry.get("timestamp"),
+        entry.get("username"),
+        entry.get("quiz_mode"),
+        entry.get("session_id"),
+        json.dumps(summary, ensure_ascii=False) if summary is not None else None
+    )
+
+
+def _row_to_entry(row: sqlite3.Row) -> Dict[str, Any]:
+    """
+    Converte una riga del database locale nel dizionario di log corrispondente
+    
+    Args:
+        row: riga di _USER_HISTORY_SQL
+        
+    Returns:
+        Dizionario con gli stessi campi delle entry originali
+    """
+    if row["type"] == "session_summary":
+        return {
+            "timestamp": _format_timestamp(row["timestamp"]),
+            "username": row["username"],
+            "quiz_mode": row["quiz_mode"],
+            "session_id": row["session_id"],
+            "type": row["type"],
+            "summary": json.loads(row["summary"]) if row["summary"] else {}
+        }
+    
+    entry = {field: row[field] for field in _ANSWER_FIELDS}
+    entry["timestamp"] = _format_timestamp(entry["timestamp"])
+    entry["is_correct"] = bool(entry["is_correct"])
+    return entry
 
 
 class QuizLogger:
     """
     Gestisce il logging delle risposte degli utenti.
-    Salva su Google Sheets (con fallback a JSON locale).
+    Salva su Google Sheets (con fallback a database SQLite locale).
     """
     
-    def __init__(self, spreadsheet_name="log_streamlit", log_file: str = "quiz_logs.json", use_google_sheets: bool = True):
+    def __init__(
+        self,
+        spreadsheet_name="log_streamlit",
+        log_file: str = "quiz_logs.db",
+        use_google_sheets: bool = True,
+        in_memory: bool = False
+    ):
         """
         Inizializza il logger
         
         Args:
-            log_file: percorso al file JSON per fallback
+            log_file: percorso al database SQLite per fallback
             use_google_sheets: se True, usa Google Sheets
+            in_memory: se True, il database locale lavora in memoria e viene copiato su disco
+                solo da flush() (a fine sessione e all'uscita del processo): insert più veloci,
+                ma un crash perde i log non ancora salvati
         """
         self.log_file = Path(log_file)
         self.use_google_sheets = use_google_sheets and GSHEETS_AVAILABLE
         self.spreadsheet_name=spreadsheet_name
+        self.in_memory = in_memory
         self.conn = None
+        self.db: Optional[sqlite3.Connection] = None
+        # File su disco di cui self.db è la copia in memoria (solo con in_memory)
+        self._disk: Optional[sqlite3.Connection] = None
+        # Da tenere per ogni uso di self.db, condivisa tra i thread delle sessioni
+        self._db_lock = _db_lock_for(self.log_file)
+        # Stato per thread: l'istanza è condivisa tra le sessioni Streamlit (get_quiz_logger),
+        # ognuna eseguita sul proprio thread
+        self._local = threading.local()
+        # Entry in attesa di invio a Google Sheets e thread che le scrive (avviato con Sheets attivo)
+        self._sheets_queue: "queue.Queue[Any]" = queue.Queue()
+        self._sheets_writer: Optional[threading.Thread] = None
+        # Fogli gspread già aperti, per nome
+        self._worksheets: Dict[str, Any] = {}
+        # Protegge l'avvio del thread di scrittura e l'apertura dei fogli, chiamati da più sessioni
+        self._sheets_lock = threading.Lock()
         
         if self.use_google_sheets:
             self._init_google_sheets()
         else:
-            self._ensure_log_file()
+            self._init_local_db()
+        
+        if self.use_google_sheets:
+            # Thread di scrittura avviato subito: nessun avvio concorrente dalle sessioni
+            self._start_sheets_writer()
+            # Le entry ancora nel buffer non vanno perse alla chiusura del processo
+            atexit.register(self.flush)
+    
+    @property
+    def _pending(self) -> Optional[List[Dict[str, Any]]]:
+        """Entry accumulate dentro session() dal thread corrente, scritte tutte insieme all'uscita"""
+        return getattr(self._local, "pending", None)
+    
+    @_pending.setter
+    def _pending(self, entries: Optional[List[Dict[str, Any]]]):
+        self._local.pending = entries
     
     def _init_google_sheets(self):
         """Inizializza la connessione a Google Sheets usando il connettore ufficiale Streamlit"""
@@ -94,12 +652,132 @@ class QuizLogger:
         except Exception as e:
             print(f"Errore inizializzazione Google Sheets: {e}")
             self.use_google_sheets = False
-            self._ensure_log_file()
+            self._init_local_db()
     
-    def _ensure_log_file(self):
-        """Crea il file di log se non esiste"""
-        if not self.log_file.exists():
-            self._save_logs([])
+    def _init_local_db(self):
+        """Apre (creandolo se non esiste) il database SQLite locale"""
+        # La stessa connessione viene riusata dai rerun Streamlit, che girano su thread diversi:
+        # ogni accesso passa da self._db_lock
+        with self._db_lock:
+            if self.in_memory:
+                # Il contenuto del file viene caricato in memoria e riscritto da flush()
+                db, self._disk = _open_memory_db(self.log_file)
+            else:
+                db = sqlite3.connect(str(self.log_file), check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.executescript(_LOCAL_PRAGMAS)
+            db.executescript(_LOCAL_SCHEMA)
+            self.db = db
+            self._import_legacy_json()
+            self._attach_archive()
+    
+    def _attach_archive(self):
+        """Collega il database di archivio (stesso nome del database locale, suffisso _archive)"""
+        # La copia in memoria è condivisa tra istanze e può essere già collegata
+        if self.db.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'").fetchone():
+            return
+        
+        archive_file = self.log_file.with_name(self.log_file.stem + "_archive" + self.log_file.suffix)
+        self.db.execute("ATTACH DATABASE ? AS archive", (str(archive_file),))
+        self.db.executescript(_ARCHIVE_SCHEMA)
+    
+    def _rotate(self, hot_limit: int = _HOT_ANSWERS_LIMIT):
+        """
+        Sposta nell'archivio le risposte più vecchie oltre le hot_limit più recenti
+        
+        Args:
+            hot_limit: numero di risposte da mantenere nella tabella principale
+        """
+        if self.db is None:
+            return
+        
+        with self._db_lock:
+            row = self.db.execute(
+                "SELECT id FROM main.quiz_answers ORDER BY id DESC LIMIT 1 OFFSET ?", (hot_limit,)
+            ).fetchone()
+            if row is None:
+                return
+            
+            with self.db:
+                for sql in _ROTATE_ANSWERS_SQL:
+                    self.db.execute(sql, (row[0],))
+    
+    def _end_session(self):
+        """Manutenzione a fine sessione di quiz, fuori dal percorso interattivo: rotazione e salvataggio su disco"""
+        # Invio a Sheets anticipato ma senza attenderlo: la pagina non resta bloccata sulla rete
+        self._flush_sheets(wait=False)
+        # Un errore di manutenzione non deve far fallire la chiamata di logging che l'ha avviata:
+        # le risposte sono già salvate e la rotazione riprova alla sessione successiva
+        try:
+            self._rotate()
+            self._save_snapshot()
+        except sqlite3.Error as e:
+            print(f"Errore manutenzione database locale: {e}")
+    
+    def _import_legacy_json(self):
+        """Importa una sola volta i log del vecchio file JSON (stesso nome, estensione .json) nel database vuoto"""
+        legacy_file = self.log_file.with_suffix(".json")
+        if legacy_file == self.log_file or not legacy_file.exists():
+            return
+        if self.db.execute(
+            "SELECT 1 FROM quiz_answers UNION ALL SELECT 1 FROM quiz_summaries LIMIT 1"
+        ).fetchone():
+            return
+        
+        try:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                logs = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return
+        
+        self._insert_local_many(logs)
+    
+    def _get_local_db(self) -> sqlite3.Connection:
+        """Restituisce la connessione al database locale, aprendola alla prima richiesta"""
+        with self._db_lock:
+            if self.db is None:
+                self._init_local_db()
+        return self.db
+    
+    def flush(self):
+        """Invia a Google Sheets le entry in coda (attendendo la scrittura) e copia su disco il database locale in memoria (se in_memory)"""
+        self._flush_sheets(wait=True)
+        self._save_snapshot()
+    
+    def _save_snapshot(self):
+        """Copia su disco il database locale in memoria (nessun effetto senza in_memory)"""
+        if self._disk is not None:
+            with self._db_lock:
+                self.db.backup(self._disk)
+    
+    def _insert_local(self, entry: Dict[str, Any]):
+        """
+        Salva una entry nel database locale
+        
+        Args:
+            entry: dizionario con i dati (risposta o riepilogo sessione)
+        """
+        db = self._get_local_db()
+        with self._db_lock, db:
+            if _is_summary(entry):
+                db.execute(_INSERT_SUMMARY_SQL, _summary_to_row(entry))
+            else:
+                db.execute(_INSERT_ANSWER_SQL, _answer_to_row(entry))
+    
+    def _insert_local_many(self, entries: List[Dict[str, Any]]):
+        """
+        Salva più entry nel database locale in un'unica transazione
+        
+        Args:
+            entries: entry da salvare (risposte e/o riepiloghi sessione)
+        """
+        answers = [_answer_to_row(entry) for entry in entries if not _is_summary(entry)]
+        summaries = [_summary_to_row(entry) for entry in entries if _is_summary(entry)]
+        
+        db = self._get_local_db()
+        with self._db_lock, db:
+            db.executemany(_INSERT_ANSWER_SQL, answers)
+            db.executemany(_INSERT_SUMMARY_SQL, summaries)
     
     def _load_logs_from_sheets(self) -> List[Dict[str, Any]]:
         """
@@ -113,36 +791,52 @@ class QuizLogger:
         
         try:
             # Leggi il foglio answers
-            df = self.conn.read(worksheet="answers", ttl=0)
+            df = _read_worksheet_cached(self.conn, self.spreadsheet_name, "answers")
             
             if df.empty:
                 return []
             
             # Converti DataFrame in lista di dizionari
-            logs = df.to_dict('records')
-            
-            # Converti tipi di dati
-            for record in logs:
-                # Converti is_correct da stringa a booleano
-                if 'is_correct' in record:
-                    record['is_correct'] = str(record['is_correct']).lower() == 'true'
-                # Converti question_id e attempt_number a int
-                if 'question_id' in record:
-                    try:
-                        record['question_id'] = int(record['question_id'])
-                    except (ValueError, TypeError):
-                        record['question_id'] = 0
-                if 'attempt_number' in record:
-                    try:
-                        record['attempt_number'] = int(record['attempt_number'])
-                    except (ValueError, TypeError):
-                        record['attempt_number'] = 1
-            
-            return logs
+            return _answers_to_records(df)
         except Exception as e:
             print(f"Errore caricamento da Sheets: {e}")
             return []
     
+    def _load_answers_frame(self, columns: Optional[Tuple[str, ...]] = None) -> pd.DataFrame:
+        """
+        Carica il foglio answers come DataFrame con i tipi convertiti, per aggregazioni
+        fatte per colonna (senza creare un dizionario per riga)
+        
+        Args:
+            columns: colonne necessarie; se indicate si scaricano solo quelle,
+                con ripiego sulla lettura dell'intero foglio
+        
+        Returns:
+            DataFrame con almeno le colonne richieste (vuoto se il foglio non è leggibile)
+        """
+        all_columns = _SHEETS_HEADERS["answers"]
+        if not self.use_google_sheets or not self.conn:
+            return pd.DataFrame(columns=all_columns)
+        
+        if columns:
+            try:
+                worksheet = self._get_worksheet("answers", write_header=False)
+                return _coerce_answer_types(
+                    _read_columns_cached(worksheet, self.spreadsheet_name, "answers", columns)
+                )
+            except Exception as e:
+                print(f"Errore lettura colonne da Sheets, lettura del foglio intero: {e}")
+        
+        try:
+            df = _read_worksheet_cached(self.conn, self.spreadsheet_name, "answers")
+        except Exception as e:
+            print(f"Errore caricamento da Sheets: {e}")
+            return pd.DataFrame(columns=all_columns)
+        
+        # Colonne mancanti aggiunte vuote, così i filtri non devono controllarne la presenza
+        df = df.reindex(columns=[*df.columns, *(column for column in all_columns if column not in df.columns)])
+        return _coerce_answer_types(df)
+    
     def _load_sessions_from_sheets(self) -> List[Dict[str, Any]]:
         """
         Carica i riassunti sessioni da Google Sheets
@@ -154,7 +848,7 @@ class QuizLogger:
             return []
         
         try:
-            df = self.conn.read(worksheet="sessions", ttl=0)
+            df = _read_worksheet_cached(self.conn, self.spreadsheet_name, "sessions")
             
             if df.empty:
                 return []
@@ -176,40 +870,128 @@ class QuizLogger:
     
     def _load_logs(self) -> List[Dict[str, Any]]:
         """
-        Carica tutti i log (da Sheets o file)
+        Carica tutti i log da Google Sheets (usato quando le query sui fogli falliscono)
         
         Returns:
             Lista di log entries
         """
-        if self.use_google_sheets:
-            # Combina logs da answers e sessions
-            answers = self._load_logs_from_sheets()
-            sessions = self._load_sessions_from_sheets()
-            return answers + sessions
-        else:
+        # Combina logs da answers e sessions
+        answers = self._load_logs_from_sheets()
+        sessions = self._load_sessions_from_sheets()
+        return answers + sessions
+    
+    def _buffer_for_sheets(self, entries: List[Dict[str, Any]]):
+        """
+        Accoda entry per Google Sheets; le scrive il thread in background
+        
+        Args:
+            entries: entry da scrivere (risposte e/o riepiloghi sessione)
+        """
+        if self._sheets_writer is None:
+            self._start_sheets_writer()
+        
+        for entry in entries:
+            self._sheets_queue.put_nowait(entry)
+    
+    def _start_sheets_writer(self):
+        """Avvia il thread di scrittura su Google Sheets, se non è già attivo"""
+        with self._sheets_lock:
+            if self._sheets_writer is None:
+                self._sheets_writer = threading.Thread(target=self._sheets_writer_loop, name="quiz-logger-sheets", daemon=True)
+                self._sheets_writer.start()
+    
+    def _flush_sheets(self, wait: bool = True):
+        """
+        Chiede al thread di scrittura di inviare subito le entry in coda
+        
+        Args:
+            wait: se True, attende che tutte le entry in coda siano state scritte
+        """
+        if self._sheets_writer is None:
+            return
+        
+        self._sheets_queue.put_nowait(_FLUSH)
+        if wait:
+            self._sheets_queue.join()
+    
+    def _sheets_writer_loop(self):
+        """Corpo del thread di scrittura: raccoglie blocchi di entry dalla coda e li invia a Google Sheets"""
+        while True:
+            # Attende la prima entry, poi raccoglie le successive fino a blocco pieno, intervallo scaduto o _FLUSH
+            batch = [self._sheets_queue.get()]
+            deadline = time.monotonic() + _SHEETS_FLUSH_INTERVAL
+            while batch[-1] is not _FLUSH and len(batch) < _SHEETS_BATCH_SIZE:
+                try:
+                    batch.append(self._sheets_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            
             try:
-                with open(self.log_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError):
-                return []
+                self._write_batch_to_sheets([entry for entry in batch if entry is not _FLUSH])
+            except Exception as e:
+                print(f"Errore scrittura in background su Sheets: {e}")
+            finally:
+                for _ in batch:
+                    self._sheets_queue.task_done()
+    
+    def _write_batch_to_sheets(self, entries: List[Dict[str, Any]]):
+        """
+        Invia un blocco di entry a Google Sheets, una chiamata per foglio
+        
+        Args:
+            entries: entry da scrivere (risposte e/o riepiloghi sessione)
+        """
+        answers = [entry for entry in entries if not _is_summary(entry)]
+        sessions = [entry for entry in entries if _is_summary(entry)]
+        
+        if answers:
+            self._save_to_sheets(answers, is_session=False)
+        if sessions:
+            self._save_to_sheets(sessions, is_session=True)
+        
+        # Le letture in cache non includono le righe appena scritte
+        if entries:
+            _clear_logs_cache()
     
-    def _save_logs(self, logs: List[Dict[str, Any]]):
+    def _get_worksheet(self, worksheet_name: str, write_header: bool = True):
         """
-        Salva i log nel file (fallback)
+        Restituisce il foglio gspread, aperto alla prima richiesta e poi riusato.
+        Un foglio vuoto riceve prima la riga di intestazione
         
         Args:
-            logs: lista di log entries
+            worksheet_name: "answers" o "sessions"
+            write_header: se False (letture) un foglio vuoto solleva ValueError invece di
+                ricevere l'intestazione, e chi legge ripiega sulla lettura del connettore
+            
+        Returns:
+            Worksheet gspread del client del connettore
         """
-        with open(self.log_file, 'w', encoding='utf-8') as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
+        worksheet = self._worksheets.get(worksheet_name)
+        if worksheet is not None:
+            return worksheet
+        
+        # Sotto lock: il thread di scrittura e le letture non aprono due volte lo stesso foglio
+        # né scrivono due volte l'intestazione
+        with self._sheets_lock:
+            worksheet = self._worksheets.get(worksheet_name)
+            if worksheet is None:
+                worksheet = self.conn.client._select_worksheet(
+                    spreadsheet=self.spreadsheet_name, worksheet=worksheet_name
+                )
+                if not worksheet.row_values(1):
+                    if not write_header:
+                        raise ValueError(f"Foglio {worksheet_name} senza intestazione")
+                    worksheet.append_row(_SHEETS_HEADERS[worksheet_name], value_input_option="RAW")
+                self._worksheets[worksheet_name] = worksheet
+        return worksheet
     
-    def _save_to_sheets(self, entry: Dict[str, Any], is_session: bool = False):
+    def _save_to_sheets(self, entries: List[Dict[str, Any]], is_session: bool = False):
         """
-        Salva una entry su Google Sheets usando il connettore Streamlit
+        Aggiunge un blocco di entry in fondo al foglio Google Sheets
         
         Args:
-            entry: dizionario con i dati
-            is_session: True se è un session summary, False se è una risposta
+            entries: dizionari con i dati, tutti dello stesso tipo
+            is_session: True se sono session summary, False se sono risposte
         """
         if not self.use_google_sheets or not self.conn:
             return
@@ -217,51 +999,26 @@ class QuizLogger:
         try:
             worksheet_name = "sessions" if is_session else "answers"
             
-            # Crea DataFrame da una singola riga
-            if is_session:
-                data = {
-                    'timestamp': [entry.get('timestamp', '')],
-                    'username': [entry.get('username', '')],
-                    'quiz_mode': [entry.get('quiz_mode', '')],
-                    'session_id': [entry.get('session_id', '')],
-                    'type': [entry.get('type', 'session_summary')],
-                    'summary_json': [json.dumps(entry.get('summary', {}), ensure_ascii=False)]
-                }
-            else:
-                data = {
-                    'timestamp': [entry.get('timestamp', '')],
-                    'username': [entry.get('username', '')],
-                    'quiz_mode': [entry.get('quiz_mode', '')],
-                    'module_name': [entry.get('module_name', '')],
-                    'question_id': [entry.get('question_id', 0)],
-                    'user_answer': [entry.get('user_answer', '')],
-                    'correct_answer': [entry.get('correct_answer', '')],
-                    'is_correct': [str(entry.get('is_correct', False))],
-                    'attempt_number': [entry.get('attempt_number', 1)],
-                    'session_id': [entry.get('session_id', '')]
-                }
-            
-            df_new = pd.DataFrame(data)
+            rows = _sheet_rows(entries, worksheet_name)
+            worksheet = self._get_worksheet(worksheet_name)
             
-            # Append diretto senza leggere i dati esistenti (molto più veloce)
-            try:                
-                # Se arriviamo qui, il foglio esiste - usa append
-                print("Saving with append mode")
-                self.conn.update(
-                    spreadsheet=self.spreadsheet_name,
-                    worksheet=worksheet_name,
-                    data=df_new,
-                    # Append mode - aggiunge alla fine senza leggere tutto
-                )
-            except Exception as e:
-                print(f"Direct append failed: {str(e)}")
+            for attempt in range(_SHEETS_MAX_ATTEMPTS):
+                try:
+                    # values.append lato server: invia solo le nuove righe, senza rileggere né
+                    # riscrivere il foglio (conn.update cancella il foglio e lo riscrive da capo).
+                    # RAW mantiene i valori come testo, nello stesso formato letto da _load_logs_from_sheets
+                    worksheet.append_rows(rows, value_input_option="RAW", insert_data_option="INSERT_ROWS")
+                    return
+                except Exception as e:
+                    # Quota di scritture superata (HTTP 429): nuovo tentativo dopo un'attesa
+                    # esponenziale con jitter; gli altri errori vanno subito al fallback locale
+                    if not _is_rate_limited(e) or attempt == _SHEETS_MAX_ATTEMPTS - 1:
+                        raise
+                    time.sleep(2 ** attempt + random.random())
             
         except Exception as e:
-            print(f"Errore salvataggio su Sheets, fallback a JSON locale: {e}")
-            # Fallback a file JSON
-            logs = self._load_logs()
-            logs.append(entry)
-            self._save_logs(logs)
+            print(f"Errore salvataggio su Sheets, fallback a database locale: {e}")
+            self._insert_local_many(entries)
     
     def log_answer(
         self,
@@ -289,27 +1046,30 @@ class QuizLogger:
             attempt_number: numero del tentativo (per modalità single_question)
             session_id: ID univoco della sessione di quiz
         """
-        entry = QuizLogEntry(
-            timestamp=datetime.now().isoformat(),
-            username=username,
-            quiz_mode=quiz_mode,
-            module_name=module_name,
-            question_id=question_id,
-            user_answer=user_answer,
-            correct_answer=correct_answer,
-            is_correct=is_correct,
-            attempt_number=attempt_number,
-            session_id=session_id
-        )
-        
-        entry_dict = asdict(entry)
+        if not self.use_google_sheets and self._pending is None:
+            # Database locale: parametri legati direttamente, senza entry intermedie
+            with self._db_lock, self.db:
+                self.db.execute(_INSERT_ANSWER_SQL, (
+                    time.time_ns(), username, quiz_mode, module_name, question_id, user_answer,
+                    correct_answer, int(is_correct), attempt_number, session_id
+                ))
+            return
         
-        if self.use_google_sheets:
-            self._save_to_sheets(entry_dict, is_session=False)
-        else:
-            logs = self._load_logs()
-            logs.append(entry_dict)
-            self._save_logs(logs)
+        # Dizionario costruito direttamente dagli argomenti (stessi campi di QuizLogEntry)
+        entry = {
+            "timestamp": time.time_ns(),
+            "username": username,
+            "quiz_mode": quiz_mode,
+            "module_name": module_name,
+            "question_id": question_id,
+            "user_answer": user_answer,
+            "correct_answer": correct_answer,
+            "is_correct": is_correct,
+            "attempt_number": attempt_number,
+            "session_id": session_id
+        }
+        
+        self._write_entry(entry)
     
     def log_session_summary(
         self,
@@ -328,7 +1088,7 @@ class QuizLogger:
             summary_data: dati di riepilogo (score, tempo, ecc.)
         """
         entry = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": time.time_ns(),
             "username": username,
             "quiz_mode": quiz_mode,
             "session_id": session_id,
@@ -336,12 +1096,71 @@ class QuizLogger:
             "summary": summary_data
         }
         
+        self._write_entry(entry)
+        if self._pending is None:
+            self._end_session()
+    
+    def log_answers_bulk(self, entries: List[QuizLogEntry]):
+        """
+        Registra più risposte insieme (una sola transazione sul database locale)
+        
+        Args:
+            entries: risposte da registrare
+        """
+        self._write_entries([entry.as_dict() for entry in entries])
+    
+    @contextmanager
+    def session(self) -> Iterator["QuizLogger"]:
+        """
+        Raggruppa le chiamate a log_answer / log_session_summary fatte nel blocco with
+        e le scrive tutte all'uscita, anche se il blocco termina con un'eccezione
+        
+        Esempio:
+            with logger.session():
+                for ...:
+                    logger.log_answer(...)
+        """
+        if self._pending is not None:
+            # Già dentro una session(): le entry finiscono nel buffer esterno
+            yield self
+            return
+        
+        self._pending = []
+        try:
+            yield self
+        finally:
+            entries, self._pending = self._pending, None
+            self._write_entries(entries)
+            self._end_session()
+    
+    def _write_entry(self, entry: Dict[str, Any]):
+        """
+        Scrive una entry (o la accoda se è aperta una session())
+        
+        Args:
+            entry: dizionario con i dati (risposta o riepilogo sessione)
+        """
+        if self._pending is not None:
+            self._pending.append(entry)
+        elif self.use_google_sheets:
+            self._buffer_for_sheets([entry])
+        else:
+            self._insert_local(entry)
+    
+    def _write_entries(self, entries: List[Dict[str, Any]]):
+        """
+        Scrive più entry; sul database locale in un'unica transazione
+        
+        Args:
+            entries: entry da scrivere (risposte e/o riepiloghi sessione)
+        """
+        if not entries:
+            return
+        
         if self.use_google_sheets:
-            self._save_to_sheets(entry, is_session=True)
+            self._buffer_for_sheets(entries)
         else:
-            logs = self._load_logs()
-            logs.append(entry)
-            self._save_logs(logs)
+            self._insert_local_many(entries)
     
     def get_user_history(self, username: str) -> List[Dict[str, Any]]:
         """
@@ -355,17 +1174,16 @@ class QuizLogger:
         """
         if self.use_google_sheets and self.conn:
             try:
-                # Query diretta sul foglio answers
-                query = f'SELECT * WHERE B = "{username}"'  # Colonna B = username
-                df_answers = self.conn.query(worksheet="answers", sql=query, ttl=0)
-                
-                # Query diretta sul foglio sessions
-                df_sessions = self.conn.query(worksheet="sessions", sql=query, ttl=0)
+                # Query diretta sui fogli answers e sessions (SQL duckdb del connettore:
+                # il foglio è la tabella, lo username una stringa letterale con apici escapati)
+                condition = f"WHERE username = {_sql_literal(username)}"
+                df_answers = _query_worksheet_cached(self.conn, self.spreadsheet_name, "answers", f"SELECT * FROM answers {condition}")
+                df_sessions = _query_worksheet_cached(self.conn, self.spreadsheet_name, "sessions", f"SELECT * FROM sessions {condition}")
                 
                 # Combina i risultati
                 logs = []
                 if not df_answers.empty:
-                    logs.extend(df_answers.to_dict('records'))
+                    logs.extend(_answers_to_records(df_answers))
                 if not df_sessions.empty:
                     sessions = df_sessions.to_dict('records')
                     # Deserializza summary_json per sessions
@@ -384,8 +1202,9 @@ class QuizLogger:
                 logs = self._load_logs()
                 return [log for log in logs if log.get("username") == username]
         else:
-            logs = self._load_logs()
-            return [log for log in logs if log.get("username") == username]
+            with self._db_lock:
+                rows = self.db.execute(_USER_HISTORY_SQL, (username,)).fetchall()
+            return [_row_to_entry(row) for row in rows]
     
     def get_question_stats(self, module_name: str, question_id: int) -> Dict[str, Any]:
         """
@@ -398,61 +1217,51 @@ class QuizLogger:
         Returns:
             Dizionario con statistiche (total_attempts, correct_rate, ecc.)
         """
-        if self.use_google_sheets and self.conn:
-            try:
-                # Query diretta: filtra per module_name e question_id
-                # Colonna D = module_name, Colonna E = question_id
-                query = f'SELECT * WHERE D = "{module_name}" AND E = {question_id}'
-                df = self.conn.query(worksheet="answers", sql=query, ttl=0)
-                
-                if df.empty:
-                    return {
-                        "total_attempts": 0,
-                        "correct_attempts": 0,
-                        "correct_rate": 0.0
-                    }
-                
-                question_logs = df.to_dict('records')
-                total = len(question_logs)
-                correct = sum(1 for log in question_logs if str(log.get("is_correct", "false")).lower() == "true")
-                unique_users = df['username'].nunique() if 'username' in df.columns else 0
-                
+        # Database locale: lettura dei contatori mantenuti a ogni insert
+        if not self.use_google_sheets:
+            with self._db_lock:
+                total, correct, unique_users = self.db.execute(
+                    "SELECT COALESCE(SUM(total), 0), COALESCE(SUM(correct), 0), "
+                    "(SELECT COUNT(username) FROM quiz_stat_users WHERE module_name = ?1 AND question_id = ?2) "
+                    "FROM quiz_stats WHERE module_name = ?1 AND question_id = ?2",
+                    (module_name, question_id)
+                ).fetchone()
+            
+            if not total:
                 return {
-                    "total_attempts": total,
-                    "correct_attempts": correct,
-                    "correct_rate": (correct / total * 100) if total > 0 else 0.0,
-                    "unique_users": unique_users
+                    "total_attempts": 0,
+                    "correct_attempts": 0,
+                    "correct_rate": 0.0
                 }
-            except Exception as e:
-                print(f"Errore query Google Sheets: {e}")
-                # Fallback
-                pass
-        
-        # Fallback al metodo tradizionale
-        logs = self._load_logs()
+            
+            return {
+                "total_attempts": total,
+                "correct_attempts": correct,
+                "correct_rate": correct / total * 100,
+                "unique_users": unique_users
+            }
         
-        question_logs = [
-            log for log in logs
-            if log.get("module_name") == module_name and
-               log.get("question_id") == question_id and
-               log.get("type") != "session_summary"
+        # Google Sheets: aggregati per colonna sulle sole colonne delle statistiche
+        answers = self._load_answers_frame(_STATS_COLUMNS)
+        question_answers = answers[
+            (answers["module_name"] == module_name) & (answers["question_id"] == question_id)
         ]
         
-        if not question_logs:
+        if question_answers.empty:
             return {
                 "total_attempts": 0,
                 "correct_attempts": 0,
                 "correct_rate": 0.0
             }
         
-        total = len(question_logs)
-        correct = sum(1 for log in question_logs if log.get("is_correct", False))
+        total = len(question_answers)
+        correct = int(question_answers["is_correct"].sum())
         
         return {
             "total_attempts": total,
             "correct_attempts": correct,
             "correct_rate": (correct / total * 100) if total > 0 else 0.0,
-            "unique_users": len(set(log.get("username") for log in question_logs))
+            "unique_users": int(question_answers["username"].nunique())
         }
     
     def get_module_stats(self, module_name: str) -> Dict[str, Any]:
@@ -465,54 +1274,44 @@ class QuizLogger:
         Returns:
             Dizionario con statistiche aggregate
         """
-        if self.use_google_sheets and self.conn:
-            try:
-                # Query diretta: filtra per module_name (Colonna D)
-                query = f'SELECT * WHERE D = "{module_name}"'
-                df = self.conn.query(worksheet="answers", sql=query, ttl=0)
-                
-                if df.empty:
-                    return {
-                        "total_attempts": 0,
-                        "correct_rate": 0.0,
-                        "unique_users": 0
-                    }
-                
-                module_logs = df.to_dict('records')
-                total = len(module_logs)
-                correct = sum(1 for log in module_logs if str(log.get("is_correct", "false")).lower() == "true")
-                unique_users = df['username'].nunique() if 'username' in df.columns else 0
-                
+        # Database locale: somma dei contatori delle domande del modulo
+        if not self.use_google_sheets:
+            with self._db_lock:
+                total, correct, unique_users = self.db.execute(
+                    "SELECT COALESCE(SUM(total), 0), COALESCE(SUM(correct), 0), "
+                    "(SELECT COUNT(DISTINCT username) FROM quiz_stat_users WHERE module_name = ?1) "
+                    "FROM quiz_stats WHERE module_name = ?1",
+                    (module_name,)
+                ).fetchone()
+            
+            if not total:
                 return {
-                    "total_attempts": total,
-                    "correct_attempts": correct,
-                    "correct_rate": (correct / total * 100) if total > 0 else 0.0,
-                    "unique_users": unique_users
+                    "total_attempts": 0,
+                    "correct_rate": 0.0,
+                    "unique_users": 0
                 }
-            except Exception as e:
-                print(f"Errore query Google Sheets: {e}")
-                # Fallback
-                pass
-        
-        # Fallback al metodo tradizionale
-        logs = self._load_logs()
+            
+            return {
+                "total_attempts": total,
+                "correct_attempts": correct,
+                "correct_rate": correct / total * 100,
+                "unique_users": unique_users
+            }
         
-        module_logs = [
-            log for log in logs
-            if log.get("module_name") == module_name and
-               log.get("type") != "session_summary"
-        ]
+        # Google Sheets: aggregati per colonna sulle sole colonne delle statistiche
+        answers = self._load_answers_frame(_STATS_COLUMNS)
+        module_answers = answers[answers["module_name"] == module_name]
         
-        if not module_logs:
+        if module_answers.empty:
             return {
                 "total_attempts": 0,
                 "correct_rate": 0.0,
                 "unique_users": 0
             }
         
-        total = len(module_logs)
-        correct = sum(1 for log in module_logs if log.get("is_correct", False))
-        unique_users = len(set(log.get("username") for log in module_logs))
+        total = len(module_answers)
+        correct = int(module_answers["is_correct"].sum())
+        unique_users = int(module_answers["username"].nunique())
         
         return {
             "total_attempts": total,
@@ -531,11 +1330,26 @@ class QuizLogger:
         Returns:
             Dizionario con statistiche utente
         """
-        logs = self.get_user_history(username)
-        
-        answer_logs = [log for log in logs if log.get("type") != "session_summary"]
+        # Conteggi per modulo: [risposte date, risposte corrette]
+        if not self.use_google_sheets:
+            # Database locale: un solo GROUP BY sugli indici per username (tabella principale e archivio)
+            with self._db_lock:
+                rows = self.db.execute(_USER_STATS_SQL, (username,)).fetchall()
+            per_module = {module: [answered, correct] for module, answered, correct in rows}
+        else:
+            # Google Sheets: un solo groupby per modulo sulle colonne delle statistiche
+            answers = self._load_answers_frame(_STATS_COLUMNS)
+            user_answers = answers[answers["username"] == username]
+            counts = pd.DataFrame({
+                "answered": user_answers["user_answer"].ne("(Non hai risposto)"),
+                "correct": user_answers["is_correct"]
+            }).groupby(user_answers["module_name"].fillna(""), sort=False).sum()
+            per_module = {
+                module: [int(answered), int(correct)]
+                for module, answered, correct in counts.itertuples(name=None)
+            }
         
-        if not answer_logs:
+        if not per_module:
             return {
                 "total_questions_answered": 0,
                 "correct_rate": 0.0,
@@ -543,22 +1357,20 @@ class QuizLogger:
                 "modules_stats": {}
             }
         
-        total = sum(1 for log in answer_logs if log.get("user_answer", "")!="(Non hai risposto)")
-        correct = sum(1 for log in answer_logs if log.get("is_correct", False))
-        modules = list(set(log.get("module_name") for log in answer_logs if log.get("module_name")))
+        total = sum(counts[0] for counts in per_module.values())
+        correct = sum(counts[1] for counts in per_module.values())
+        modules = [module for module in per_module if module]
         
         # Statistiche per modulo
-        modules_stats = {}
-        for module in modules:
-            module_logs = [log for log in answer_logs if log.get("module_name") == module]
-            module_total = sum(1 for log in answer_logs if log.get("user_answer", "")!="(Non hai risposto)")
-            module_correct = sum(1 for log in module_logs if log.get("is_correct", False))
-            
-            modules_stats[module] = {
+        modules_stats = {
+            module: {
                 "total_questions": module_total,
                 "correct_answers": module_correct,
                 "correct_rate": (module_correct / module_total * 100) if module_total > 0 else 0.0
             }
+            for module, (module_total, module_correct) in per_module.items()
+            if module
+        }
         
         return {
             "total_questions_answered": total,
@@ -569,9 +1381,12 @@ class QuizLogger:
         }
 
 
+@st.cache_resource
 def get_quiz_logger() -> QuizLogger:
     """
-    Factory function per ottenere un'istanza di QuizLogger
+    Factory function per ottenere l'istanza di QuizLogger
+    L'istanza è unica per processo (st.cache_resource): connessione, coda di scrittura
+    e thread in background sopravvivono ai rerun e sono condivisi tra le sessioni
     """
     return QuizLogger()
 
@@ -582,12 +1397,6 @@ def generate_session_id() -> str:
     Genera un ID univoco per la sessione
     
     Returns:
-        Stringa con timestamp e random component
+        Stringa con timestamp e random component (6 caratteri esadecimali)
     """
-    from datetime import datetime
-    import random
-    import string
-    
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
-    return f"{timestamp}_{random_str}"
+    return f"{datetime.now():%Y%m%d%H%M%S}_{secrets.token_hex(3)}"
@@ -13,6 +13,21 @@ from dataclasses import dataclass, field
 from enum import Enum
 
 
+def normalize_answer(answer: str) -> str:
+    """
+    Normalizza una risposta per il confronto: spazi esterni rimossi e casefold
+    (più corretto di lower() per lettere accentate e non ASCII).
+    Usata da tutte le modalità di quiz, così la stessa risposta ha lo stesso esito ovunque
+    
+    Args:
+        answer: risposta da normalizzare
+        
+    Returns:
+        Risposta normalizzata
+    """
+    return answer.strip().casefold()
+
+
 class QuestionStatus(Enum):
     """Stati possibili per una domanda"""
     NOT_ANSWERED = "not_answered"
@@ -139,7 +154,7 @@ class SingleQuestionQuizEngine:
         attempt.num_attempts += 1
         
         # Verifica correttezza (case-insensitive, strip whitespace)
-        is_correct = answer.strip().lower() == question["risposta_corretta"].strip().lower()
+        is_correct = normalize_answer(answer) == normalize_answer(question["risposta_corretta"])
         
         if is_correct:
             attempt.status = QuestionStatus.CORRECT
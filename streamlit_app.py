@@ -11,18 +11,19 @@ Con autenticazione e logging opzionali.
 from pathlib import Path
 import streamlit as st
 from datetime import datetime
+import math
 import time
 
 # Import dei moduli custom
 from quiz_loader import QuizLoader
-from quiz_engine import SingleQuestionQuizEngine
+from quiz_engine import SingleQuestionQuizEngine, normalize_answer
 from complete_quiz_engine import CompleteQuizEngine
 from exam_engine import ExamEngine
 from auth import (
-    AuthManager, init_session_auth, login_user, logout_user,
+    get_auth_manager, init_session_auth, login_user, logout_user,
     is_authenticated, get_current_user
 )
-from logger import QuizLogger, generate_session_id
+from logger import get_quiz_logger, generate_session_id
 
 
 # ============================================================================
@@ -47,11 +48,11 @@ def init_session_state():
     
     # Auth manager
     if "auth_manager" not in st.session_state:
-        st.session_state.auth_manager = AuthManager()
+        st.session_state.auth_manager = get_auth_manager()
     
     # Logger
     if "quiz_logger" not in st.session_state:
-        st.session_state.quiz_logger = QuizLogger()
+        st.session_state.quiz_logger = get_quiz_logger()
     
     # Engine attivo
     if "active_engine" not in st.session_state:
@@ -719,7 +720,8 @@ def show_exam_quiz():
     st.subheader(f"📚 {module_engine.module_name}")
     
     # Timer
-    remaining_seconds = module_engine.get_remaining_seconds(module_engine.module_name)
+    # Secondi interi per il display, arrotondati per eccesso: 0:00 solo a tempo scaduto
+    remaining_seconds = math.ceil(module_engine.get_remaining_seconds())
     minutes = remaining_seconds // 60
     seconds = remaining_seconds % 60
     
@@ -742,7 +744,7 @@ def show_exam_quiz():
         st.empty()
     
     # Verifica scadenza tempo
-    if module_engine.is_time_expired(module_engine.module_name):
+    if module_engine.is_time_expired():
         st.error("⏰ Tempo scaduto!")
         result = exam_engine.finish_current_module()
         
@@ -779,7 +781,7 @@ def show_exam_quiz():
                 is_correct = False
                 user_answer_display = "(Non hai risposto)"
             else:
-                is_correct = user_answer.strip().lower() == correct_answer.strip().lower()
+                is_correct = normalize_answer(user_answer) == normalize_answer(correct_answer)
                 user_answer_display = user_answer
             
             icon = "✅" if is_correct else "❌"
@@ -858,7 +860,7 @@ def show_exam_quiz():
                 if answer is None or answer == "":
                     is_correct = False
                 else:
-                    is_correct = answer.strip().lower() == question["risposta_corretta"].strip().lower()
+                    is_correct = normalize_answer(answer) == normalize_answer(question["risposta_corretta"])
                 
                 # st.session_state.quiz_logger.log_answer(
                 #     username=user.username,
@@ -971,7 +973,7 @@ def show_exam_module_results():
             is_correct = False
             user_answer_display = "(Non hai risposto)"
         else:
-            is_correct = user_answer.strip().lower() == correct_answer.strip().lower()
+            is_correct = normalize_answer(user_answer) == normalize_answer(correct_answer)
             user_answer_display = user_answer
         
         icon = "✅" if is_correct else "❌"